@@ -15,6 +15,8 @@ import sys
 sys.path.insert(0, '..')
 sys.path.insert(0, os.path.abspath('../../src'))
 sys.path.insert(0, os.path.abspath('../../src/etl'))
+# the src entry points that share a name with an etl module are imported as src.<name>
+sys.path.append(os.path.abspath('../..'))
 
 
 # -- Project information -----------------------------------------------------
@@ -0,0 +1,28 @@
+"""Defines the BatchRunner entry point."""
+
+# config libs
+from etl.config import Config
+# pipeline libs
+from etl.batch import BatchRunner
+
+
+def run(local, overrides=None):
+    """The batch.py script entry point to run the specs of the
+    BATCH.SPECS file on one shared Spark session.
+
+    Args:
+        local: If True uses the AWS EMR and S3 configurations,
+            otherwise uses the local file system and the localhost
+            Spark session.
+        overrides: A dictionary of SECTION.OPTION keys and values
+            that override the etl.cfg options of all runs.
+    """
+    # sets the session host
+    config = Config(local=local, overrides=overrides)
+
+    # run all specs, the session is stopped even when a run failed
+    runner = BatchRunner.from_config(config)
+    try:
+        runner.start()
+    finally:
+        runner.stop()
@@ -0,0 +1,251 @@
+"""Runs the ETLPipeline in local mode against synthetic Sparkify data
+generated at different scales and saves the timings to a results file.
+
+Example: python src/benchmark.py --scales 1 10 100 --backends string native
+"""
+
+# system libs
+import argparse
+import itertools
+import os
+import random
+import shutil
+import string
+from datetime import datetime, timezone
+# data libs
+import json
+# config libs
+from etl.config import Config
+# pipeline libs
+from etl.pipeline import ETLPipeline
+
+BASE_SONGS = 2000
+"""The number of songs generated at scale 1."""
+BASE_USERS = 100
+"""The number of users generated at scale 1."""
+BASE_EVENTS = 8000
+"""The number of log events generated at scale 1."""
+DAYS = 30
+"""The number of daily log files, all of them in November 2018."""
+SKEW = 1.1
+"""The Zipf exponent of the user and song popularity."""
+PAGES = ['NextSong'] * 16 + ['Home', 'Logout', 'Settings', 'About']
+"""The page distribution, where 80% of the events are NextSong."""
+RUN_OUTPUTS = ('BRONZE', 'SILVER', 'GOLD', 'MANIFEST', 'METRICS', 'CHECKPOINT', 'CACHE')
+"""The S3_LOCAL output directories of a run, cleared before each run."""
+
+
+class SyntheticData:
+    """This class defines a generator of log_data and song_data JSON
+    files that match the etl.metadata schema.
+
+    The users and songs popularity follows a Zipf distribution, so a
+    few heavy hitters get most of the events, like in the real logs.
+
+    Usage example:
+
+    SyntheticData(scale=10, seed=42).generate('data/benchmark/scale-10/landing')
+    """
+
+    def __init__(self, scale, seed=42):
+        """Creates the SyntheticData object.
+
+        Args:
+            scale: The multiplier of the number of songs, users and events.
+            seed: The random generator seed.
+        """
+        self.scale = scale
+        self.random = random.Random(seed)
+
+    def _id(self, prefix):
+        """Returns a random Million Song Dataset like identifier."""
+        return prefix + ''.join(self.random.choices(string.ascii_uppercase + string.digits, k=16))
+
+    def _words(self, count):
+        """Returns a random title with the given number of words."""
+        return ' '.join(''.join(self.random.choices(string.ascii_lowercase, k=self.random.randint(3, 9)))
+                        for _ in range(count)).title()
+
+    @staticmethod
+    def _zipf_weights(size):
+        """Returns the cumulative Zipf weights of a ranked population."""
+        return list(itertools.accumulate(1 / (rank ** SKEW) for rank in range(1, size + 1)))
+
+    def _songs(self):
+        """Generates the song records, three songs by artist on average."""
+        artists = [{'artist_id': self._id('AR'),
+                    'artist_name': self._words(self.random.randint(1, 3)),
+                    'artist_location': self.random.choice(['', 'New York, NY', 'London, England', 'Paris']),
+                    'artist_latitude': self.random.choice([None, round(self.random.uniform(-90, 90), 5)]),
+                    'artist_longitude': self.random.choice([None, round(self.random.uniform(-180, 180), 5)])}
+                   for _ in range(max(1, BASE_SONGS * self.scale // 3))]
+
+        return [dict(self.random.choice(artists),
+                     num_songs=1,
+                     song_id=self._id('SO'),
+                     title=self._words(self.random.randint(1, 5)),
+                     duration=round(self.random.uniform(60, 600), 5),
+                     year=self.random.choice([0] + list(range(1960, 2019))))
+                for _ in range(BASE_SONGS * self.scale)]
+
+    def _users(self):
+        """Generates the user records."""
+        return [{'userId': str(user_id),
+                 'firstName': self._words(1),
+                 'lastName': self._words(1),
+                 'gender': self.random.choice(['F', 'M']),
+                 'level': self.random.choice(['free', 'paid']),
+                 'location': self.random.choice(['San Francisco-Oakland-Hayward, CA', 'Phoenix-Mesa-Scottsdale, AZ']),
+                 'userAgent': self.random.choice(['Mozilla/5.0 (Macintosh)', 'Mozilla/5.0 (Windows NT 6.1)']),
+                 'registration': 1540000000000.0}
+                for user_id in range(1, BASE_USERS * self.scale + 1)]
+
+    def _events(self, songs, users, weights, day):
+        """Generates the log events of a day.
+
+        Args:
+            songs: The song records.
+            users: The user records.
+            weights: The cumulative song and user weights tuple.
+            day: The day of the month.
+        """
+        song_weights, user_weights = weights
+        start = int(datetime(2018, 11, day, tzinfo=timezone.utc).timestamp() * 1000)
+        count = BASE_EVENTS * self.scale // DAYS
+
+        for item in range(count):
+            user = self.random.choices(users, cum_weights=user_weights)[0]
+            page = self.random.choice(PAGES)
+            song = self.random.choices(songs, cum_weights=song_weights)[0] if page == 'NextSong' else None
+
+            yield dict(user,
+                       artist=song['artist_name'] if song else None,
+                       song=song['title'] if song else None,
+                       length=song['duration'] if song else None,
+                       auth='Logged In', method='PUT' if song else 'GET', status=200,
+                       page=page,
+                       sessionId=self.random.randint(1, count),
+                       itemInSession=item % 100,
+                       ts=start + self.random.randint(0, 86399999))
+
+    def generate(self, landing):
+        """Writes the song_data and log_data JSON files.
+
+        Args:
+            landing: The landing zone directory.
+        """
+        songs = self._songs()
+        users = self._users()
+        weights = (self._zipf_weights(len(songs)), self._zipf_weights(len(users)))
+
+        for song in songs:
+            # song_data/A/B/C/TRABC...json like the Million Song Dataset
+            track = self._id('TR')
+            folder = os.path.join(landing, 'song_data', *track[2:5])
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f'{track}.json'), 'w', encoding='utf-8') as file:
+                json.dump(song, file)
+
+        folder = os.path.join(landing, 'log_data', '2018', '11')
+        os.makedirs(folder, exist_ok=True)
+        for day in range(1, DAYS + 1):
+            with open(os.path.join(folder, f'2018-11-{day:02d}-events.json'), 'w', encoding='utf-8') as file:
+                file.writelines(json.dumps(event) + '\n' for event in self._events(songs, users, weights, day))
+
+
+def table_bytes(pipeline):
+    """Returns the Parquet size in bytes of each table written by a pipeline."""
+    sizes = {}
+    for name, definition in pipeline.registry.tables.items():
+        pattern = definition.partition_spec(pipeline.config).file_pattern(definition.output_path(pipeline.config))
+        sizes[name] = sum(file['size'] for file in pipeline.storage.list(pattern))
+    return sizes
+
+
+def benchmark(scale, root, seed, backend='string'):
+    """Generates the data of a scale, when it does not exist yet,
+    and runs the pipeline in local mode against it.
+
+    The outputs of the previous runs of the scale and backend are
+    cleared first, so every run starts from the landing files only,
+    without reusing the bronze files, the song cache or the tables
+    merged by an earlier run, and the timings are comparable.
+
+    Args:
+        scale: The synthetic data scale.
+        root: The benchmark data directory.
+        seed: The random generator seed.
+        backend: The TRANSFORM.BACKEND of the run.
+
+    Returns:
+        A dictionary with the phase and table timings and
+        the Parquet size in bytes of each table.
+    """
+    folder = os.path.abspath(os.path.join(root, f'scale-{scale}'))
+    landing = os.path.join(folder, 'landing')
+
+    if not os.path.exists(landing):
+        print(f'INFO: Generate scale {scale} synthetic data.')
+        SyntheticData(scale=scale, seed=seed).generate(landing)
+
+    outputs = os.path.join(folder, 'runs', backend)
+    if os.path.exists(outputs):
+        shutil.rmtree(outputs)
+
+    config = Config(local=True)
+    for option in RUN_OUTPUTS:
+        config.set('S3_LOCAL', option, os.path.join(outputs, option.lower()))
+    config.set('S3_LOCAL', 'LANDING', landing)
+    config.set('TRANSFORM', 'BACKEND', backend)
+
+    pipeline = ETLPipeline(config)
+    pipeline.start()
+    pipeline.stop()
+
+    records = pipeline.metrics.records
+    return {
+        'scale': scale,
+        'backend': backend,
+        'phases': {record['phase']: record['wall_time'] for record in records if record['table'] is None},
+        'tables': {f"{record['phase']}:{record['table']}": record['wall_time']
+                   for record in records if record['table'] is not None},
+        'table_bytes': table_bytes(pipeline),
+        'stats': pipeline.stats
+    }
+
+
+if __name__ == "__main__":
+    """Sets the argument parser for the benchmark.py script."""
+
+    # the benchmark always runs on a single box
+    os.environ.setdefault('PYSPARK_SUBMIT_ARGS', '--master local[*] pyspark-shell')
+
+    # create the command line parser
+    parser = argparse.ArgumentParser(description='Sparkify ETL Pipeline local benchmark')
+
+    # set the command line arguments
+    parser.add_argument('-s', '--scales', nargs='+', type=int, default=[1, 10, 100],
+                        help='The synthetic data scales - default: 1 10 100')
+    parser.add_argument('-d', '--data', default='data/benchmark',
+                        help='The synthetic data directory - default: data/benchmark')
+    parser.add_argument('-o', '--output', default='data/benchmark/results.json',
+                        help='The results JSON file - default: data/benchmark/results.json')
+    parser.add_argument('-b', '--backends', nargs='+', default=['string'],
+                        choices=['string', 'native', 'arrow'],
+                        help='The transform backends - default: string')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='The random generator seed - default: 42')
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the benchmark for each scale
+    results = {'started': datetime.now(timezone.utc).isoformat(),
+               'runs': [benchmark(scale, args.data, args.seed, backend)
+                        for scale in args.scales for backend in args.backends]}
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2)
+
+    print(f'INFO: Benchmark results saved to {args.output}')
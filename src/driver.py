@@ -11,10 +11,28 @@ import argparse
 import importlib
 
 
-def run(main, local):
+def parse_overrides(items):
+    """Parses a list of SECTION.OPTION=VALUE config overrides.
+
+    Args:
+        items: The list of --conf argument values.
+
+    Returns:
+        A dictionary of SECTION.OPTION keys and values.
+    """
+    overrides = {}
+    for item in items or []:
+        key, separator, value = item.partition('=')
+        if not separator:
+            raise SyntaxError(f'Invalid config override {item}, the format is SECTION.OPTION=VALUE')
+        overrides[key.strip()] = value.strip()
+    return overrides
+
+
+def run(main, local, overrides=None):
     """Executes the main module loaded."""
     module = importlib.import_module(main)
-    sys.exit(module.run(local))
+    sys.exit(module.run(local, overrides=overrides))
 
 
 if __name__ == "__main__":
@@ -28,15 +46,34 @@ if __name__ == "__main__":
 
     main_message = 'The module where the run method to start the pipeline is declared.'
     local_message = 'Loads data from the local file system and sets Spark session to localhost - default: ASW EMR'
+    conf_message = 'Overrides an etl.cfg option, e.g. --conf PIPELINE.INCREMENTAL=True - can be repeated'
+    tables_message = 'Comma separated list of tables to run, e.g. --tables songplays,time - default: all tables'
+    runs_message = 'The run specs JSON file of the batch module, e.g. batch --runs runs.json'
+    explain_message = 'Saves the query plan report of the tables without running the pipeline - default: False'
 
     # set the command line arguments
     parser.add_argument('main', help=main_message, default='main')
     parser.add_argument('-l', '--local', action='store_true',
                         help=local_message,
                         default=False)
+    parser.add_argument('-c', '--conf', action='append', metavar='SECTION.OPTION=VALUE',
+                        help=conf_message,
+                        default=[])
+    parser.add_argument('-t', '--tables', help=tables_message, default=None)
+    parser.add_argument('-e', '--explain', action='store_true', help=explain_message, default=False)
+    parser.add_argument('-r', '--runs', help=runs_message, default=None)
 
     # parse the command line arguments
     args = parser.parse_args()
 
+    # the table selection, the explain mode and the run specs are config overrides
+    overrides = parse_overrides(args.conf)
+    if args.tables:
+        overrides['PIPELINE.TABLES'] = args.tables
+    if args.explain:
+        overrides['PIPELINE.EXPLAIN'] = 'True'
+    if args.runs:
+        overrides['BATCH.SPECS'] = args.runs
+
     # run the pipeline
-    run(args.main, args.local)
+    run(args.main, args.local, overrides)
@@ -1,5 +1,49 @@
+from .batch import *
+from .cache import *
 from .config import *
+from .dedup import *
+from .explain import *
+from .incremental import *
+from .join import *
+from .manifest import *
+from .memory import *
+from .merge import *
 from .metadata import *
+from .metrics import *
 from .pipeline import *
+from .quality import *
+from .registry import *
+from .smallfiles import *
+from .storage import *
+from .streaming import *
+from .tuning import *
+from .writer import *
 
-__all__ = ('Config', 'ETLPipeline', 'metadata', 'schema')
+__all__ = (
+    'BatchRunner',
+    'Config',
+    'ETLPipeline',
+    'DagExecutor',
+    'DimensionCache',
+    'deduplicate',
+    'ManifestReader',
+    'ManifestWriter',
+    'MemoryBudget',
+    'MergeWriter',
+    'MetricsCollector',
+    'PartitionSpec',
+    'PlanReport',
+    'QualityCheck',
+    'RunSpec',
+    'SmallFileMerger',
+    'SongLookup',
+    'Storage',
+    'StreamingPipeline',
+    'TableDefinition',
+    'TableRegistry',
+    'TableWriter',
+    'TuningProfile',
+    'Watermark',
+    'metadata',
+    'schema',
+)
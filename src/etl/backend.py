@@ -0,0 +1,77 @@
+"""Defines the column expressions of the start_time and songplay_id
+derived columns for each transform backend:
+
+- string: start_time is a yyyy-MM-dd HH:mm:ss.SSS string and
+  songplay_id the user, session and item separated by a dash.
+- native: start_time is a millisecond timestamp and songplay_id a
+  64-bit hash, both computed by Spark built-in functions.
+- arrow: the same types of the native backend, computed by
+  vectorized pandas UDFs over Arrow batches.
+"""
+
+# spark libs
+from pyspark.sql.functions import col, concat, concat_ws, expr, from_unixtime, lit, pandas_udf, substring, xxhash64
+from pyspark.sql.types import LongType, TimestampType
+
+try:
+    import pandas as pd
+    Series = pd.Series
+except ImportError:  # the arrow backend requires pandas and pyarrow
+    pd = Series = None
+
+
+def _arrow_start_time(ts: Series) -> Series:
+    """Converts the unix epoch milliseconds into UTC timestamps."""
+    return pd.to_datetime(ts, unit='ms', utc=True)
+
+
+def _arrow_songplay_id(user_id: Series, session_id: Series, item_in_session: Series) -> Series:
+    """Hashes the user, session and item of each row into a 64-bit id."""
+    rows = pd.DataFrame({'user_id': user_id, 'session_id': session_id, 'item': item_in_session})
+    return pd.Series(pd.util.hash_pandas_object(rows, index=False).values.view('int64'))
+
+
+def _arrow_udf(function, return_type):
+    """Wraps a pandas function into a scalar pandas UDF.
+
+    Raises:
+        ValueError: If pandas is not installed.
+    """
+    if pd is None:
+        raise ValueError('The arrow transform backend requires the pandas and pyarrow packages')
+    return pandas_udf(function, return_type)
+
+
+def start_time(backend):
+    """Returns the start_time expression derived from the ts column.
+
+    Args:
+        backend: The transform backend name.
+    """
+    if backend == 'native':
+        return expr('timestamp_millis(ts)')
+    if backend == 'arrow':
+        return _arrow_udf(_arrow_start_time, TimestampType())(col('ts'))
+
+    return concat_ws('.',
+                     from_unixtime((col('ts') / 1000), 'yyyy-MM-dd HH:mm:ss'),
+                     substring(col('ts'), -3, 3))
+
+
+def songplay_id(backend):
+    """Returns the songplay_id expression derived from the user_id,
+    session_id and itemInSession columns.
+
+    Args:
+        backend: The transform backend name.
+    """
+    if backend == 'native':
+        return xxhash64(col('user_id'), col('session_id'), col('itemInSession'))
+    if backend == 'arrow':
+        return _arrow_udf(_arrow_songplay_id, LongType())(col('user_id'), col('session_id'), col('itemInSession'))
+
+    # the separator keeps e.g. user 2 session 15 and user 21 session 5 apart,
+    # and concat, unlike concat_ws, keeps the id null when a part is null
+    return concat(col('user_id'), lit('-'),
+                  col('session_id').cast('string'), lit('-'),
+                  col('itemInSession').cast('string'))
@@ -0,0 +1,257 @@
+"""Defines the RunSpec and BatchRunner classes to execute many pipeline
+runs, e.g. the days of a backfill, on one shared Spark application."""
+
+# sys libs
+from datetime import date, datetime, timedelta, timezone
+from timeit import default_timer as timer
+# data libs
+import json
+# spark libs
+from pyspark.sql import SparkSession
+# pipeline libs
+from etl.pipeline import ETLPipeline
+from etl.registry import DagExecutor
+from etl.storage import Storage
+
+ISOLATED_PATHS = ('BRONZE', 'SILVER', 'GOLD', 'MANIFEST', 'METRICS', 'CHECKPOINT', 'CACHE')
+"""The S3 output directories that are separated by run name."""
+
+
+class RunSpec:
+    """This class defines one run of a batch.
+
+    The outputs of each run are written to the S3 output directories
+    suffixed by the run name, so the runs never share a file.
+
+    Usage example:
+
+    spec = RunSpec.from_dict({'name': 'week-1', 'dates': ['2018-11-01', '2018-11-07'],
+                              'tables': ['songplays', 'time']})
+    config = base_config.derive(spec.overrides_for(base_config))
+    """
+
+    def __init__(self, name, dates=None, landing=None, tables=None, overrides=None):
+        """Creates the RunSpec object.
+
+        Args:
+            name: The run name, a valid directory name.
+            dates: An optional (start, end) tuple of ISO dates, both
+                included, that selects the daily log_data files.
+            landing: An optional input prefix that replaces S3 LANDING.
+            tables: The optional list of tables to run.
+            overrides: A dictionary of SECTION.OPTION keys and values.
+        """
+        self.name = name
+        self.dates = dates
+        self.landing = landing
+        self.tables = tables or []
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Creates the RunSpec object from a dictionary of the specs file.
+
+        Raises:
+            ValueError: If the name is missing or the dates are invalid.
+        """
+        name = spec.get('name')
+        if not name or '/' in name:
+            raise ValueError(f'Invalid run spec {spec}, the name is required and must not have a /')
+
+        dates = spec.get('dates')
+        if dates is not None:
+            if len(dates) != 2:
+                raise ValueError(f'Invalid dates of the run {name}, the format is [start, end]')
+            dates = tuple(date.fromisoformat(value) for value in dates)
+            if dates[0] > dates[1]:
+                raise ValueError(f'Invalid dates of the run {name}, the start is after the end')
+
+        tables = spec.get('tables') or []
+        tables = tables.split(',') if isinstance(tables, str) else tables
+        return cls(name, dates, spec.get('landing'), [table.strip() for table in tables], spec.get('overrides'))
+
+    def _daily_pattern(self, pattern, daily):
+        """Returns the glob pattern of the daily files of the run dates.
+
+        Args:
+            pattern: The glob pattern of all files. E.g. log_data/*/*/*.json
+            daily: The daily file path format. E.g. {year}/{month:02d}/{date}-events.json
+        """
+        prefix = pattern.split('*')[0].rstrip('/')
+        days = [self.dates[0] + timedelta(days=offset) for offset in range((self.dates[1] - self.dates[0]).days + 1)]
+        files = [daily.format(year=day.year, month=day.month, day=day.day, date=day.isoformat()) for day in days]
+        return f"{prefix}/{{{','.join(files)}}}"
+
+    def overrides_for(self, config):
+        """Returns the config overrides of the run.
+
+        Args:
+            config: The batch Config object.
+
+        The dates select the daily files of the landing zone, so they
+        also enable the small files merge stage, that reads them on
+        AWS EMR instead of the files grouped by s3-dist-cp.
+
+        Returns:
+            A dictionary of SECTION.OPTION keys and values, where the
+            spec overrides take precedence.
+        """
+        section = 'S3_LOCAL' if config.local else 'S3'
+        overrides = {f'{section}.{option}': f"{config.parser.get(section, option).rstrip('/')}/{self.name}"
+                     for option in ISOLATED_PATHS}
+
+        if self.landing:
+            overrides[f'{section}.LANDING'] = self.landing
+        if self.dates:
+            daily = config.get('FILES', 'LOGS_DAILY')
+            overrides['FILES.LOGS_LANDING'] = self._daily_pattern(config.get('FILES', 'LOGS_LANDING'), daily)
+            # the files copied by s3-dist-cp are grouped, so the daily files are read from the landing zone
+            overrides['SMALL_FILES.ENABLED'] = 'True'
+        if self.tables:
+            overrides['PIPELINE.TABLES'] = ','.join(self.tables)
+
+        overrides.update(self.overrides)
+        return overrides
+
+
+class BatchRunner:
+    """This class defines the batch driver of the pipeline runs.
+
+    All runs share the SparkContext, so the JVM and the executors
+    start once. Each run has its own session, from newSession, with
+    its own runtime settings and temporary views, and its own job
+    group prefix in the metrics. With BATCH.PARALLEL the runs are
+    submitted concurrently to the FAIR scheduler, otherwise they run
+    in the order of the specs file. A failed run does not stop the
+    other runs, and the combined timing report is saved to the S3
+    METRICS directory.
+
+    Usage example:
+
+    runner = BatchRunner.from_config(config)
+    runner.start()
+    runner.stop()
+    """
+
+    def __init__(self, spark, config, specs, parallel=False, max_workers=1):
+        """Creates the BatchRunner object.
+
+        Args:
+            spark: The shared Spark session.
+            config: The batch Config object.
+            specs: The list of RunSpec objects.
+            parallel: If True runs the specs concurrently.
+            max_workers: The max number of concurrent runs.
+
+        Raises:
+            ValueError: If two runs have the same name.
+        """
+        names = [spec.name for spec in specs]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Duplicated run names: {', '.join(duplicates)}")
+
+        self.spark = spark
+        self.config = config
+        self.specs = specs
+        self.parallel = parallel
+        self.max_workers = max_workers if parallel else 1
+        self.storage = Storage(spark)
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the shared Spark session and the BatchRunner object
+        from the BATCH config section.
+
+        Raises:
+            ValueError: If the BATCH.SPECS file is not set or not found.
+        """
+        path = config.get('BATCH', 'SPECS')
+        if not path:
+            raise ValueError('The BATCH.SPECS option must be set to the run specs JSON file')
+
+        parallel = config.getboolean('BATCH', 'PARALLEL')
+        builder = SparkSession.builder.appName(config.get('SPARK', 'APP_NAME'))
+        # the concurrent runs, and their parallel loads, share the executors fairly
+        if parallel or config.getboolean('LOAD', 'PARALLEL'):
+            builder = builder.config('spark.scheduler.mode', 'FAIR')
+        spark = builder.getOrCreate()
+
+        if not config.local:
+            spark.sparkContext.setLogLevel('WARN')
+
+        text = Storage(spark).read_text(path)
+        if text is None:
+            raise ValueError(f'The run specs file {path} was not found')
+
+        specs = [RunSpec.from_dict(spec) for spec in json.loads(text)]
+        return cls(spark, config, specs, parallel=parallel, max_workers=config.getint('BATCH', 'MAX_WORKERS'))
+
+    def _run(self, spec):
+        """Runs the pipeline of a spec and returns its report record."""
+        record = {'name': spec.name, 'status': 'success'}
+        start = timer()
+        try:
+            config = self.config.derive(spec.overrides_for(self.config))
+            context = self.spark.sparkContext
+            context.setLocalProperty('spark.scheduler.pool', spec.name if self.parallel else None)
+
+            pipeline = ETLPipeline(config, spark=self.spark.newSession(), name=spec.name)
+            record['metrics'] = pipeline.start()
+            record['phases'] = {phase: pipeline.metrics.wall_time(phase)
+                                for phase in ('extract', 'transform', 'load')}
+            record['stats'] = pipeline.stats
+            pipeline.stop()
+        except Exception as error:  # pylint: disable=broad-except
+            print(f'ERROR: Run {spec.name} failed: {error}')
+            record.update(status='failed', error=str(error))
+        record['wall_time'] = round(timer() - start, 3)
+        return record
+
+    def start(self):
+        """Executes all runs, prints and saves the combined timing report.
+
+        Returns:
+            The path of the JSON report.
+
+        Raises:
+            RuntimeError: If any of the runs failed, after all runs finished.
+        """
+        print('-----------------------------------------------------')
+        print(f"AWS EMR Spark ETL Batch of {len(self.specs)} runs, {'parallel' if self.parallel else 'sequential'}")
+        print('-----------------------------------------------------')
+
+        started = datetime.now(timezone.utc)
+        start = timer()
+        specs = {spec.name: spec for spec in self.specs}
+        records = DagExecutor(self.max_workers).run({name: [] for name in specs}, lambda name: self._run(specs[name]))
+        runs = [records[name] for name in specs]
+
+        report = {'started': started.isoformat(),
+                  'application_id': self.spark.sparkContext.applicationId,
+                  'parallel': self.parallel,
+                  'wall_time': round(timer() - start, 3),
+                  'runs_time': round(sum(run['wall_time'] for run in runs), 3),
+                  'runs': runs}
+
+        print('-----------------------------------------------------')
+        print('Batch Time Statistics')
+        print('-----------------------------------------------------')
+        for run in runs:
+            print(f"{run['name']}: {run['status']} in {round(run['wall_time'], 2)} seconds")
+        print(f"Sum of run times: {round(report['runs_time'], 2)} seconds")
+        print(f"Total time: {round(report['wall_time'], 2)} seconds")
+
+        path = f"{self.config.get('S3', 'METRICS')}/batch-{started.strftime('%Y%m%dT%H%M%S')}.json"
+        self.storage.write_text(path, json.dumps(report, indent=2, default=str))
+        print('-----------------------------------------------------')
+        print(f'INFO: Batch report saved to {path}')
+
+        failed = [run['name'] for run in runs if run['status'] != 'success']
+        if failed:
+            raise RuntimeError(f"Failed runs: {', '.join(failed)}")
+        return path
+
+    def stop(self):
+        """Stop the shared SparkContext."""
+        self.spark.stop()
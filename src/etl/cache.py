@@ -0,0 +1,173 @@
+"""Defines the DimensionCache class to reuse the join-ready song lookup
+dimension across the pipeline runs while the song data is unchanged."""
+
+# sys libs
+import hashlib
+from datetime import datetime, timezone
+# data libs
+import json
+
+
+class DimensionCache:
+    """This class defines a content-addressed cache of song lookups.
+
+    Each entry is keyed by the hash of the song data files listing,
+    paths, sizes and modification times, and of the lookup options,
+    so any change of the input files invalidates it. The lookup is
+    saved as a table bucketed and sorted by song_key, that is joined
+    with the log data without shuffling the lookup again.
+
+    After each new entry, the least recently used entries are
+    evicted until the cache fits under its max size.
+
+    Usage example:
+
+    cache = DimensionCache.from_config(spark, storage, config)
+    key = cache.key(storage.list(pattern), precision=3)
+    lookup = cache.get(key)
+    if lookup is None:
+        cache.put(key, song_lookup.build(song_data))
+    """
+
+    ENTRY = '_entry.json'
+    """The entry metadata file name."""
+
+    def __init__(self, spark, storage, path, max_size, buckets):
+        """Creates the DimensionCache object.
+
+        Args:
+            spark: The Spark session.
+            storage: The file system adapter.
+            path: The cache directory.
+            max_size: The max cache size in bytes.
+            buckets: The number of buckets of the lookup tables.
+        """
+        self.spark = spark
+        self.storage = storage
+        self.path = path
+        self.max_size = max_size
+        self.buckets = buckets
+
+    @classmethod
+    def from_config(cls, spark, storage, config):
+        """Creates the DimensionCache object from the CACHE config section."""
+        return cls(spark, storage, config.get('S3', 'CACHE'),
+                   max_size=config.getint('CACHE', 'MAX_SIZE_MB') * 1024 * 1024,
+                   buckets=config.getint('JOIN', 'BUCKETS'))
+
+    def key(self, files, **options):
+        """Returns the cache key of an input files listing.
+
+        Args:
+            files: A list of files returned by Storage.list.
+            options: The options the cached data depends on.
+        """
+        # the cache path is hashed too, as the catalog table names are shared by the batch runs
+        listing = json.dumps({'files': [[file['path'], file['size'], file['mtime']] for file in files],
+                              'options': dict(options, buckets=self.buckets),
+                              'path': self.path}, sort_keys=True)
+        return hashlib.sha1(listing.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _table(key):
+        """Returns the catalog table name of a cache entry."""
+        return f'song_lookup_{key}'
+
+    def _read_entry(self, key):
+        """Reads the metadata of a cache entry, or None when it does not exist."""
+        text = self.storage.read_text(f'{self.path}/{key}/{self.ENTRY}')
+        return json.loads(text) if text is not None else None
+
+    def _write_entry(self, key, entry):
+        """Writes the metadata of a cache entry."""
+        self.storage.write_text(f'{self.path}/{key}/{self.ENTRY}', json.dumps(entry, indent=2))
+
+    def get(self, key):
+        """Reads the lookup of a cache entry and marks it as used.
+
+        The bucketed table is registered in the session catalog,
+        as the catalog of a local session does not persist.
+
+        Args:
+            key: The cache key.
+
+        Returns:
+            The bucketed lookup DataFrame, or None on a cache miss.
+        """
+        entry = self._read_entry(key)
+        if entry is None:
+            return None
+
+        table = self._table(key)
+        self.spark.sql(f"CREATE TABLE IF NOT EXISTS {table} ({entry['columns']}) USING parquet "
+                       f"CLUSTERED BY (song_key) SORTED BY (song_key) INTO {entry['buckets']} BUCKETS "
+                       f"LOCATION '{self.path}/{key}/lookup'")
+
+        entry['accessed'] = datetime.now(timezone.utc).isoformat()
+        self._write_entry(key, entry)
+        return self.spark.table(table)
+
+    def put(self, key, lookup):
+        """Saves a lookup as a new cache entry and evicts the least
+        recently used entries when the cache exceeds its max size.
+
+        Args:
+            key: The cache key.
+            lookup: The lookup DataFrame with the song_key column.
+        """
+        location = f'{self.path}/{key}/lookup'
+        # one task by bucket writes a single sorted file by bucket
+        lookup.repartition(self.buckets, 'song_key').write.mode('overwrite') \
+            .bucketBy(self.buckets, 'song_key').sortBy('song_key') \
+            .option('path', location).saveAsTable(self._table(key))
+
+        now = datetime.now(timezone.utc).isoformat()
+        self._write_entry(key, {
+            'created': now,
+            'accessed': now,
+            'buckets': self.buckets,
+            'columns': ', '.join(f'{field.name} {field.dataType.simpleString()}' for field in lookup.schema.fields),
+            'size': sum(file['size'] for file in self.storage.list(f'{location}/*.parquet'))
+        })
+        self.evict(keep=key)
+
+    def entries(self):
+        """Returns a dictionary with the metadata of each cache entry."""
+        entries = {}
+        for file in self.storage.list(f'{self.path}/*/{self.ENTRY}'):
+            key = file['path'].rstrip('/').split('/')[-2]
+            entries[key] = self._read_entry(key)
+        return entries
+
+    def invalidate(self, key=None):
+        """Deletes a cache entry, or all entries when no key is given.
+
+        Args:
+            key: The cache key.
+        """
+        for name in [key] if key else list(self.entries()):
+            self.spark.sql(f'DROP TABLE IF EXISTS {self._table(name)}')
+            self.storage.delete(f'{self.path}/{name}')
+
+    def evict(self, keep=None):
+        """Deletes the least recently used entries until the cache fits
+        under its max size.
+
+        Args:
+            keep: The key of an entry that is never evicted.
+
+        Returns:
+            The list of evicted keys.
+        """
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries.values())
+        evicted = []
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['accessed']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self.invalidate(key)
+            total -= entry['size']
+            evicted.append(key)
+        return evicted
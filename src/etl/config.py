@@ -1,6 +1,7 @@
 """Defines a Config class to read the AWS EMR configuration from etl.cfg file."""
 
 # sys libs
+import functools
 import os
 # config libs
 import configparser
@@ -25,6 +26,67 @@ CONFIG_EMR_PATH = SCRIPT_PATH.replace(SCRIPT_NAME, CONFIG_NAME)
 CONFIG_LOCAL_PATH = os.path.join(SCRIPT_DIR, CONFIG_NAME)
 """The config file absolute path in the local environment."""
 
+ENV_PREFIX = 'ETL__'
+"""The prefix of the environment variables that override config
+options, in the format ETL__<SECTION>__<OPTION>=value."""
+
+STORAGE_LEVELS = ('DISK_ONLY', 'DISK_ONLY_2', 'MEMORY_ONLY', 'MEMORY_ONLY_2',
+                  'MEMORY_AND_DISK', 'MEMORY_AND_DISK_2', 'OFF_HEAP')
+"""The valid Spark storage level names."""
+
+TRANSFORM_BACKENDS = ('string', 'native', 'arrow')
+"""The valid transform backend names."""
+
+PARQUET_CODECS = ('none', 'uncompressed', 'snappy', 'gzip', 'lzo', 'brotli', 'lz4', 'zstd')
+"""The valid Spark Parquet compression codec names."""
+
+OPTION_TYPES = {
+    'BATCH': {'SPECS': str, 'PARALLEL': bool, 'MAX_WORKERS': int},
+    'BRONZE': {'TARGET_FILE_SIZE_MB': int},
+    'CACHE': {'ENABLED': bool, 'MAX_SIZE_MB': int},
+    'DEDUP': {'SALT_BUCKETS': int},
+    'GOLD': {'ENABLED': bool, 'ROLLUPS': list},
+    'JOIN': {'BROADCAST_THRESHOLD_MB': int, 'BUCKETS': int, 'DURATION_PRECISION': int},
+    'LOAD': {'PARALLEL': bool, 'MAX_WORKERS': int},
+    'MEMORY': {'BOUNDED': bool, 'HEAP_FRACTION': float, 'OFF_HEAP_FRACTION': float},
+    'PIPELINE': {'INCREMENTAL': bool, 'TABLES': list, 'EXPLAIN': bool},
+    'PROFILE_*': {'MAX_INPUT_MB': int, 'SHUFFLE_PARTITIONS': int, 'ADAPTIVE': bool, 'BROADCAST_THRESHOLD_MB': int,
+                  'PARQUET_CODEC': PARQUET_CODECS, 'KRYO': bool},
+    'QUALITY': {'ENABLED': bool, 'NULL_KEYS_WARN': float, 'NULL_KEYS_FAIL': float, 'DUPLICATE_KEYS_WARN': float,
+                'DUPLICATE_KEYS_FAIL': float, 'ORPHANS_WARN': float, 'ORPHANS_FAIL': float,
+                'MIN_ROWS_WARN': float, 'MIN_ROWS_FAIL': float},
+    'SMALL_FILES': {'ENABLED': bool, 'BATCH_SIZE_MB': int, 'MAX_WORKERS': int},
+    'STREAMING': {'TRIGGER': str, 'MAX_FILES_PER_TRIGGER': int},
+    'SPARK': {'APP_NAME': str, 'PROFILE': str, 'STORAGE_LEVEL': STORAGE_LEVELS},
+    'TABLE_*': {'PARTITION_BY': list, 'BUCKET_BY': str, 'BUCKETS': int, 'MERGE': bool, 'SCD2': bool},
+    'TRANSFORM': {'BACKEND': TRANSFORM_BACKENDS},
+    'WRITE': {'TARGET_FILE_SIZE_MB': int, 'COMPACT': bool, 'COMPACT_MIN_FILES': int, 'MANIFEST': bool}
+}
+"""Defines the type of the validated options of each section,
+where a tuple is the list of valid values and a section name
+ending with * matches all sections with that prefix."""
+
+
+@functools.lru_cache(maxsize=2)
+def _read_config(local):
+    """Reads the config cfg file once per python process.
+
+    In the AWS EMR environment the file is read from the archive
+    package, so the wheel is opened only once.
+
+    Args:
+        local: Defines if the file is read from the local file system.
+
+    Returns:
+        The config file content.
+    """
+    if local:
+        with open(CONFIG_LOCAL_PATH, encoding='utf-8') as config:
+            return config.read()
+
+    with zipfile.ZipFile(PACKAGE_PATH, 'r') as zip_ref:
+        return zip_ref.read(f'{PACKAGE_DIR}/{CONFIG_NAME}').decode('UTF-8')
+
 
 class Config:
     """This class defines a wrapper for ConfigParser.
@@ -32,38 +94,138 @@ class Config:
     Use the etl.cfg file as a reference to configure
     the application according to your AWS account settings.
 
+    The options can be overridden by environment variables in the
+    format ETL__<SECTION>__<OPTION>=value and by a dictionary of
+    overrides, e.g. from the driver.py --conf arguments, that take
+    precedence over the environment variables.
+
     Usage example:
 
-    config = Config()
+    config = Config(overrides={'PIPELINE.INCREMENTAL': 'True'})
     config.get('S3', 'LANDING')
+    config.getboolean('PIPELINE', 'INCREMENTAL')
     """
 
-    def __init__(self, local=False):
+    def __init__(self, local=False, overrides=None):
         """Creates a Config object from pipeline.cfg file.
 
         Config values will be UTF-8 encoded.
 
         Args:
             local: Defines if the data will be loaded and stored locally.
+            overrides: A dictionary of SECTION.OPTION keys and values.
+
+        Raises:
+            ValueError: If an override key or an option value is invalid.
         """
         self.local = local
+        self._cache = {}
         self._init_parser()
+        self._apply_overrides(overrides or {})
+        self.validate()
 
-    def _init_parser(self):
-        """Initializes the config parser from a cfg file."""
+    def _init_parser(self, values=None):
+        """Initializes the config parser from a cfg file or a dictionary."""
         self.parser = configparser.ConfigParser()
+        # keep the option names upper case like in the cfg file
+        self.parser.optionxform = str
 
-        if self.local:
-            self.parser.read_file(open(CONFIG_LOCAL_PATH, encoding='utf-8'))
+        if values is None:
+            self.parser.read_string(_read_config(self.local))
         else:
-            self.parser.read_string(self._unzip_config())
+            self.parser.read_dict(values)
+
+    def _apply_overrides(self, overrides):
+        """Applies the environment and the given overrides."""
+        for name, value in os.environ.items():
+            if name.startswith(ENV_PREFIX) and name.count('__') == 2:
+                section, option = name[len(ENV_PREFIX):].split('__')
+                self.set(section, option, value)
+        self._set_overrides(overrides)
+
+    def _set_overrides(self, overrides):
+        """Applies a dictionary of SECTION.OPTION overrides."""
+        for key, value in overrides.items():
+            section, _, option = key.partition('.')
+            if not option:
+                raise ValueError(f'Invalid config override {key}, the format is SECTION.OPTION')
+            self.set(section, option, value)
+
+    def __getstate__(self):
+        """Serializes the config as a dictionary of sections, so the
+        executors do not read the cfg file or the archive package."""
+        return {'local': self.local,
+                'values': {section: dict(self.parser.items(section, raw=True))
+                           for section in self.parser.sections()}}
+
+    def __setstate__(self, state):
+        """Restores the config from the serialized dictionary."""
+        self.local = state['local']
+        self._cache = {}
+        self._init_parser(state['values'])
 
-    @staticmethod
-    def _unzip_config():
-        """Reads the config cfg file from the archive package."""
-        with zipfile.ZipFile(PACKAGE_PATH, 'r') as zip_ref:
-            config = zip_ref.read(f'{PACKAGE_DIR}/{CONFIG_NAME}')
-            return config.decode('UTF-8')
+    def derive(self, overrides):
+        """Returns a copy of the config with more overrides applied,
+        e.g. the config of each run of a batch.
+
+        Args:
+            overrides: A dictionary of SECTION.OPTION keys and values.
+
+        Raises:
+            ValueError: If an override key or an option value is invalid.
+        """
+        config = Config.__new__(Config)
+        config.__setstate__(self.__getstate__())
+        config._set_overrides(overrides)
+        config.validate()
+        return config
+
+    def _types(self, section):
+        """Returns the option types of a section."""
+        for name, types in OPTION_TYPES.items():
+            if name.endswith('*') and section.startswith(name[:-1]):
+                return types
+        return OPTION_TYPES.get(section, {})
+
+    def validate(self):
+        """Checks the type of all validated options.
+
+        Raises:
+            ValueError: With the list of all invalid options.
+        """
+        accessors = {int: self.getint, float: self.getfloat, bool: self.getboolean, list: self.getlist,
+                     str: self.get}
+        errors = []
+
+        for section in self.parser.sections():
+            for option, option_type in self._types(section).items():
+                try:
+                    if isinstance(option_type, tuple):
+                        if self.get(section, option) not in option_type:
+                            errors.append(f'{section}.{option} must be one of {", ".join(option_type)}')
+                    elif option_type in (int, float) and accessors[option_type](section, option) < 0:
+                        errors.append(f'{section}.{option} must not be negative')
+                    else:
+                        accessors[option_type](section, option)
+                except (configparser.Error, ValueError) as error:
+                    errors.append(f'{section}.{option}: {error}')
+
+        if errors:
+            raise ValueError('Invalid etl.cfg options:\n' + '\n'.join(errors))
+
+    def sections(self, prefix=''):
+        """Returns the names of the sections starting with a prefix.
+
+        Args:
+            prefix: The section name prefix. E.g. TABLE_
+        """
+        return [section for section in self.parser.sections() if section.startswith(prefix)]
+
+    def _cached(self, key, read):
+        """Memoizes the value read by a function."""
+        if key not in self._cache:
+            self._cache[key] = read()
+        return self._cache[key]
 
     def get(self, section, option):
         """Reads a config option value from a section.
@@ -84,5 +246,69 @@ class Config:
             value = config.get('EMR', 'CLUSTER_ID')
         """
         if section == 'S3' and self.local:
-            return os.path.join(SCRIPT_DIR, self.parser.get('S3_LOCAL', option))
-        return self.parser.get(section, option)
+            return self._cached(('path', option),
+                                lambda: os.path.join(SCRIPT_DIR, self.parser.get('S3_LOCAL', option)))
+        return self._cached(('str', section, option), lambda: self.parser.get(section, option))
+
+    def getboolean(self, section, option):
+        """Reads a boolean config option value from a section.
+
+        Args:
+            section: The etl.cfg file section name.
+            option: The section config option name.
+
+        Returns:
+            True for the values 1, yes, true and on, otherwise False.
+        """
+        return self._cached(('bool', section, option), lambda: self.parser.getboolean(section, option))
+
+    def getint(self, section, option):
+        """Reads an integer config option value from a section.
+
+        Args:
+            section: The etl.cfg file section name.
+            option: The section config option name.
+
+        Returns:
+            The option value converted to int.
+        """
+        return self._cached(('int', section, option), lambda: self.parser.getint(section, option))
+
+    def getfloat(self, section, option):
+        """Reads a float config option value from a section.
+
+        Args:
+            section: The etl.cfg file section name.
+            option: The section config option name.
+
+        Returns:
+            The option value converted to float.
+        """
+        return self._cached(('float', section, option), lambda: self.parser.getfloat(section, option))
+
+    def getlist(self, section, option):
+        """Reads a comma separated list config option value from a section.
+
+        Args:
+            section: The etl.cfg file section name.
+            option: The section config option name.
+
+        Returns:
+            The list of non-empty stripped values.
+        """
+        return self._cached(('list', section, option),
+                            lambda: [value.strip() for value in self.parser.get(section, option).split(',')
+                                     if value.strip()])
+
+    def set(self, section, option, value):
+        """Overrides a config option value of a section.
+
+        Args:
+            section: The etl.cfg file section name.
+            option: The section config option name.
+            value: The new option value.
+        """
+        if not self.parser.has_section(section):
+            self.parser.add_section(section)
+        self.parser.set(section, option, str(value))
+        self._cache = {}
@@ -0,0 +1,54 @@
+"""Defines the deduplicate function to keep one deterministic row
+by key of the dimension tables."""
+
+# spark libs
+from pyspark.sql.functions import col, lit, max as max_, pmod, struct, xxhash64
+
+
+def deduplicate(data, keys, order_by=None, salt_buckets=1):
+    """Keeps the greatest row of each key.
+
+    The rows are compared as a struct of the order by columns followed
+    by the remaining columns, so the winner does not depend on the
+    order of the input rows and it is the same across runs. The max
+    aggregation is partially computed on the map side, so each task
+    sends at most one row by key to the shuffle.
+
+    When salt_buckets is greater than one, a first aggregation by key
+    and a salt, the hash of the row modulo salt_buckets, spreads the
+    rows of hot keys across many reducers, and a second aggregation
+    by key merges at most salt_buckets rows by key. It costs one more
+    shuffle of all rows, and it only helps when a key has distinct rows
+    in so many input tasks that their partial maxima overload one
+    reducer. The identical rows of a key get the same salt, so they are
+    never spread, they are collapsed by the partial aggregation.
+
+    Args:
+        data: The table DataFrame.
+        keys: The list of key columns.
+        order_by: The list of columns that rank the rows of a key,
+            e.g. ts to keep the latest row.
+        salt_buckets: The number of salts of the first aggregation.
+
+    Returns:
+        The DataFrame with one row by key and the same columns.
+    """
+    order_by = order_by or []
+    columns = data.columns
+    values = order_by + [name for name in data.columns if name not in keys and name not in order_by]
+
+    if not values:
+        return data.drop_duplicates(keys)
+
+    winner = struct(*[col(name) for name in values])
+
+    if salt_buckets > 1:
+        salt = pmod(xxhash64(*[col(name) for name in data.columns]), lit(salt_buckets))
+        data = data.groupBy(*keys, salt.alias('_salt')) \
+            .agg(max_(winner).alias('_winner'))
+        winner = col('_winner')
+
+    return data.groupBy(*keys) \
+        .agg(max_(winner).alias('_winner')) \
+        .select(*keys, *[col(f'_winner.{name}').alias(name) for name in values]) \
+        .select(*columns)
@@ -0,0 +1,151 @@
+"""Defines the PlanReport class to analyze the physical plans of the
+pipeline tables without executing them."""
+
+# sys libs
+import re
+from datetime import datetime, timezone
+# data libs
+import json
+# sizing libs
+from etl.sizing import estimate_bytes, to_megabytes
+
+JOIN_NODES = ('BroadcastHashJoin', 'SortMergeJoin', 'ShuffledHashJoin',
+              'BroadcastNestedLoopJoin', 'CartesianProduct')
+"""The physical plan join operators."""
+
+NESTED_LOOP_JOINS = ('BroadcastNestedLoopJoin', 'CartesianProduct')
+"""The join operators that compare every pair of rows."""
+
+_NODE = re.compile(r'^[\s:|+\-]*(?:\*\(\d+\)\s*)?(\w+)')
+"""Matches the operator name of a line of the plan tree string."""
+
+
+def _nodes(plan):
+    """Returns all nodes of a physical plan tree, with the inner plans
+    of the adaptive and the in-memory cached nodes."""
+    nodes, stack = [], [plan]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        name = node.getClass().getSimpleName()
+        if name == 'AdaptiveSparkPlanExec':
+            stack.append(node.inputPlan())
+        elif name == 'InMemoryTableScanExec':
+            stack.append(node.relation().cachedPlan())
+        children = node.children()
+        stack.extend(children.apply(index) for index in range(children.size()))
+    return nodes
+
+
+def _scan(node):
+    """Reads the format, the filters and the read schema of a file scan
+    node from its metadata, that unlike the plan string is not
+    abbreviated to the spark.sql.maxMetadataStringLength."""
+    metadata = node.metadata()
+
+    def value(name):
+        return metadata.apply(name) if metadata.contains(name) else None
+
+    def field(name):
+        text = (value(name) or '[]')[1:-1]
+        # split by the commas that are not inside the filter arguments
+        return [item for item in re.split(r',\s*(?![^(]*\))', text) if item]
+
+    return {'format': (value('Format') or 'unknown').lower(),
+            'partition_filters': field('PartitionFilters'),
+            'pushed_filters': field('PushedFilters'),
+            'read_schema': value('ReadSchema')}
+
+
+def analyze(data):
+    """Analyzes the physical plan of a DataFrame without executing it.
+
+    Args:
+        data: The DataFrame.
+
+    Returns:
+        A dictionary with the estimated size, the number of shuffle
+        and broadcast exchanges, the join operators, the file scans
+        with their pushed filters, the warnings and the plan text.
+    """
+    executed = data._jdf.queryExecution().executedPlan()
+    plan = executed.toString()
+    nodes = [match.group(1) for match in map(_NODE.match, plan.splitlines()) if match]
+    scans = [_scan(node) for node in _nodes(executed) if node.getClass().getSimpleName() == 'FileSourceScanExec']
+    size = estimate_bytes(data)
+
+    warnings = [f'{node} compares every pair of rows' for node in nodes if node in NESTED_LOOP_JOINS]
+    if 'Filter' in nodes:
+        warnings.extend(f"Filter not pushed down to the {scan['format']} scan" for scan in scans
+                        if not scan['pushed_filters'] and not scan['partition_filters'])
+    warnings.extend('Scan of an RDD, the filters and columns are not pushed down'
+                    for line in plan.splitlines() if 'Scan ExistingRDD' in line)
+
+    return {'size_bytes': size,
+            'size_mb': to_megabytes(size),
+            'shuffles': nodes.count('Exchange'),
+            'broadcasts': nodes.count('BroadcastExchange'),
+            'joins': [node for node in nodes if node in JOIN_NODES],
+            'scans': scans,
+            'warnings': warnings,
+            'plan': plan}
+
+
+class PlanReport:
+    """This class defines the query plan report of the pipeline tables.
+
+    The report is saved as a JSON document, to be compared across
+    code changes, and as a text file with the plan of each table.
+
+    Usage example:
+
+    report = PlanReport(storage, 'data/metrics')
+    report.add('songplays', songplays)
+    report.save()
+    """
+
+    def __init__(self, storage, path):
+        """Creates the PlanReport object.
+
+        Args:
+            storage: The file system adapter.
+            path: The directory of the report files.
+        """
+        self.storage = storage
+        self.path = path
+        self.tables = {}
+        self.started = datetime.now(timezone.utc)
+
+    def add(self, table, data):
+        """Analyzes the plan of a table DataFrame and prints its summary.
+
+        Args:
+            table: The table name.
+            data: The table DataFrame, as it is written.
+
+        Returns:
+            The table analysis returned by analyze.
+        """
+        result = analyze(data)
+        self.tables[table] = result
+        print(f"INFO: {table}: {result['size_mb']} MB, {result['shuffles']} shuffles, "
+              f"{result['broadcasts']} broadcasts, joins: {', '.join(result['joins']) or 'none'}")
+        for warning in result['warnings']:
+            print(f'WARN: {table}: {warning}')
+        return result
+
+    def save(self):
+        """Writes the JSON and the text report files.
+
+        Returns:
+            The paths of the JSON and text files.
+        """
+        name = f"{self.path}/explain-{self.started.strftime('%Y%m%dT%H%M%S')}"
+        document = {'created': self.started.isoformat(),
+                    'tables': {table: {key: value for key, value in result.items() if key != 'plan'}
+                               for table, result in self.tables.items()}}
+        text = '\n\n'.join(f"== {table} ==\n{result['plan']}" for table, result in self.tables.items())
+
+        self.storage.write_text(f'{name}.json', json.dumps(document, indent=2))
+        self.storage.write_text(f'{name}.txt', text + '\n')
+        return f'{name}.json', f'{name}.txt'
@@ -0,0 +1,79 @@
+"""Defines a Watermark class to keep track of the landing files that
+were already processed by the pipeline in incremental mode."""
+
+# data libs
+import json
+from datetime import datetime, timezone
+
+
+class Watermark:
+    """This class defines a persisted manifest of processed input files.
+
+    Each source (e.g. logs, songs) keeps a map of file paths to
+    their size and modification time. A file is new when it is not
+    in the manifest or when its size or modification time changed.
+    The new files are only registered on commit, after the load
+    phase succeeds, so a failed run processes them again.
+
+    Usage example:
+
+    watermark = Watermark(storage, 'data/manifest/watermark.json')
+    files = watermark.new_files('logs', storage.list(pattern))
+    watermark.register('logs', files)
+    watermark.commit()
+    """
+
+    def __init__(self, storage, path):
+        """Creates the Watermark object and loads the manifest file.
+
+        Args:
+            storage: The file system adapter.
+            path: The manifest JSON file path.
+        """
+        self.storage = storage
+        self.path = path
+        self.pending = {}
+        self.manifest = self._load()
+
+    def _load(self):
+        """Reads the manifest file or creates an empty one."""
+        text = self.storage.read_text(self.path)
+        if text is None:
+            return {'updated': None, 'sources': {}}
+        return json.loads(text)
+
+    def _files(self, source):
+        """Returns the processed files of a source."""
+        return self.manifest['sources'].get(source, {}).get('files', {})
+
+    def new_files(self, source, files):
+        """Filters the files that were not processed yet.
+
+        Args:
+            source: The source name. E.g. logs
+            files: A list of files returned by Storage.list.
+
+        Returns:
+            The list of new or modified files.
+        """
+        processed = self._files(source)
+        return [file for file in files
+                if processed.get(file['path']) != [file['size'], file['mtime']]]
+
+    def register(self, source, files):
+        """Stages the files to be added to the manifest on commit."""
+        self.pending.setdefault(source, []).extend(files)
+
+    def commit(self):
+        """Adds the staged files to the manifest and persists it."""
+        if not self.pending:
+            return
+
+        for source, files in self.pending.items():
+            entry = self.manifest['sources'].setdefault(source, {'files': {}})
+            entry['files'].update({file['path']: [file['size'], file['mtime']]
+                                   for file in files})
+
+        self.manifest['updated'] = datetime.now(timezone.utc).isoformat()
+        self.storage.write_text(self.path, json.dumps(self.manifest, indent=2))
+        self.pending = {}
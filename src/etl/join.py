@@ -0,0 +1,128 @@
+"""Defines the SongLookup class to join the log data with the song
+dimension through a precomputed song lookup key."""
+
+# spark libs
+from pyspark.sql.functions import broadcast, col, lower, round as round_, trim, xxhash64
+# dedup libs
+from etl.dedup import deduplicate
+# sizing libs
+from etl.sizing import estimate_bytes, to_megabytes
+
+LOOKUP_VERSION = 2
+"""The version of the lookup rules, part of the song dimension cache key."""
+
+
+def song_key(title, artist, duration, precision):
+    """Builds the normalized hash that identifies a song.
+
+    Args:
+        title: The song title column.
+        artist: The artist name column.
+        duration: The song duration column.
+        precision: The number of decimal places of the duration.
+
+    Returns:
+        A 64-bit hash column of the trimmed lower case title and
+        artist name and the rounded duration.
+
+    The xxhash64 function skips the null inputs, so the rows with a
+    null part must be filtered out by complete before hashing.
+    """
+    return xxhash64(lower(trim(title)), lower(trim(artist)), round_(duration, precision))
+
+
+def complete(data, names):
+    """Keeps the rows where none of the song key parts is null.
+
+    Args:
+        data: The DataFrame.
+        names: The names of the title, artist and duration columns.
+    """
+    for name in names:
+        data = data.where(col(name).isNotNull())
+    return data
+
+
+class SongLookup:
+    """This class defines the songplays join strategy.
+
+    The song data is reduced to a compact lookup dimension keyed by
+    the song_key hash. The dimension is broadcast when its estimated
+    size fits under the broadcast threshold, otherwise both sides are
+    hash partitioned into the same number of buckets by song_key and
+    joined with a sort-merge join.
+
+    Usage example:
+
+    lookup = SongLookup.from_config(config)
+    songplays = lookup.join(log_data, lookup.build(song_data))
+    """
+
+    def __init__(self, broadcast_threshold, buckets, precision):
+        """Creates the SongLookup object.
+
+        Args:
+            broadcast_threshold: The max lookup size in bytes to broadcast.
+            buckets: The number of buckets of the sort-merge join.
+            precision: The number of decimal places of the duration.
+        """
+        self.broadcast_threshold = broadcast_threshold
+        self.buckets = buckets
+        self.precision = precision
+        self.strategy = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the SongLookup object from the JOIN config section."""
+        return cls(broadcast_threshold=config.getint('JOIN', 'BROADCAST_THRESHOLD_MB') * 1024 * 1024,
+                   buckets=config.getint('JOIN', 'BUCKETS'),
+                   precision=config.getint('JOIN', 'DURATION_PRECISION'))
+
+    def build(self, song_data):
+        """Builds the lookup dimension from the song data.
+
+        Args:
+            song_data: The DataFrame with the title, artist_name,
+                duration, song_id and artist_id columns.
+
+        Returns:
+            The DataFrame with the song_key, song_id and artist_id
+            columns, where the songs with the same key keep the
+            greatest song_id and artist_id, the same across runs.
+        """
+        lookup = complete(song_data, ['title', 'artist_name', 'duration']) \
+            .withColumn('song_key', song_key(col('title'), col('artist_name'),
+                                             col('duration'), self.precision)) \
+            .select('song_key', 'song_id', 'artist_id')
+        return deduplicate(lookup, ['song_key'], order_by=['song_id'])
+
+    def join(self, log_data, lookup, bucketed=False):
+        """Joins the log data with the lookup dimension and records
+        the chosen strategy in the strategy attribute.
+
+        Args:
+            log_data: The DataFrame with the song, artist and length columns.
+            lookup: The lookup dimension returned by the build method.
+            bucketed: Defines if the lookup is a table already bucketed
+                and sorted by song_key into the same number of buckets.
+
+        Returns:
+            The log data with the song_id and artist_id columns.
+        """
+        size = estimate_bytes(lookup)
+        # the inner join drops the rows with a null key part, that must not match each other
+        log_data = complete(log_data, ['song', 'artist', 'length']) \
+            .withColumn('song_key', song_key(col('song'), col('artist'), col('length'), self.precision))
+
+        if size <= self.broadcast_threshold:
+            self.strategy = f'broadcast ({to_megabytes(size)} MB)'
+            joined = log_data.join(broadcast(lookup), 'song_key')
+        else:
+            cached = ', cached' if bucketed else ''
+            self.strategy = f'sort-merge ({to_megabytes(size)} MB, {self.buckets} buckets{cached})'
+            if not bucketed:
+                lookup = lookup.repartition(self.buckets, 'song_key').sortWithinPartitions('song_key')
+            log_data = log_data.repartition(self.buckets, 'song_key')
+            joined = log_data.join(lookup.hint('merge'), 'song_key')
+
+        return joined.drop('song_key')
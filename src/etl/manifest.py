@@ -0,0 +1,246 @@
+"""Defines the ManifestWriter and ManifestReader classes to index the
+files of the silver tables, so the readers prune them without listing
+the partition directories."""
+
+# sys libs
+import os
+from datetime import datetime, timezone
+from urllib.parse import unquote, urlparse
+# data libs
+import json
+# spark libs
+from pyspark.sql.functions import input_file_name, max as max_, min as min_
+from pyspark.sql.types import ByteType, DateType, DoubleType, FloatType, IntegerType, LongType, ShortType
+from pyspark.sql.types import StringType, StructType
+# storage libs
+from etl.storage import Storage
+
+MANIFEST_NAME = '_manifest.json'
+"""The manifest file name in the table folder, ignored by Spark readers."""
+
+FOOTER_TYPES = (ByteType, ShortType, IntegerType, LongType, FloatType, DoubleType, StringType, DateType)
+"""The column types whose min and max values are read from the Parquet
+footer statistics, that are formatted like the values of a Spark row.
+The timestamps, written as INT96 without statistics, are not."""
+
+
+def _normalize(path):
+    """Returns a file path, e.g. a percent-encoded input_file_name URI,
+    in the format listed by the Storage adapter."""
+    if Storage.is_local(path):
+        return os.path.normpath(unquote(urlparse(path).path))
+    return unquote(path)
+
+
+def _partition(path):
+    """Parses the partition values from the name=value directories of a file path."""
+    return dict(name.split('=', 1) for name in path.split('/')[:-1] if '=' in name)
+
+
+def _parse(value, data_type):
+    """Parses a Parquet statistics value formatted as a string."""
+    if isinstance(data_type, (ByteType, ShortType, IntegerType, LongType)):
+        return int(value)
+    if isinstance(data_type, (FloatType, DoubleType)):
+        return float(value)
+    return value
+
+
+class ManifestWriter:
+    """This class defines the writer of the table manifests.
+
+    The manifest lists each Parquet file of a table with its size,
+    partition values, row count and the min and max values of the
+    statistics columns. The statistics of the files added since the
+    last manifest are read from their Parquet footers, and only the
+    columns without footer statistics, like the partition columns and
+    the timestamps, are computed by one aggregation by file.
+
+    Usage example:
+
+    manifests = ManifestWriter(spark, storage)
+    manifests.write(path, PartitionSpec(['year', 'month']), ['start_time'])
+    """
+
+    def __init__(self, spark, storage):
+        """Creates the ManifestWriter object.
+
+        Args:
+            spark: The Spark session.
+            storage: The file system adapter.
+        """
+        self.spark = spark
+        self.storage = storage
+
+    def _footer(self, file):
+        """Reads the Parquet footer of a file, without reading its data."""
+        jvm = self.spark.sparkContext._jvm
+        conf = self.spark.sparkContext._jsc.hadoopConfiguration()
+        hadoop_path = jvm.org.apache.hadoop.fs.Path(file)
+        input_file = jvm.org.apache.parquet.hadoop.util.HadoopInputFile.fromPath(hadoop_path, conf)
+        reader = jvm.org.apache.parquet.hadoop.ParquetFileReader.open(input_file)
+        try:
+            return reader.getFooter()
+        finally:
+            reader.close()
+
+    def _file_statistics(self, path, files, columns):
+        """Reads the row count and the min and max values of the columns by file."""
+        schema = self.spark.read.option('basePath', path).parquet(files[0]).schema
+        types = {field.name: field.dataType for field in schema.fields}
+        columns = [name for name in columns if name in types]
+        missing = {name for name in columns if not isinstance(types[name], FOOTER_TYPES)}
+
+        statistics = {}
+        for file in files:
+            entry = {'rows': 0, 'min': dict.fromkeys(columns), 'max': dict.fromkeys(columns)}
+            found = set()
+            for block in self._footer(file).getBlocks():
+                entry['rows'] += block.getRowCount()
+                for chunk in block.getColumns():
+                    name = chunk.getPath().toDotString()
+                    if name not in columns or name in missing:
+                        continue
+                    found.add(name)
+                    values = chunk.getStatistics()
+                    if values.isEmpty():
+                        missing.add(name)
+                    elif values.hasNonNullValue():
+                        lower = _parse(values.minAsString(), types[name])
+                        upper = _parse(values.maxAsString(), types[name])
+                        current = entry['min'][name], entry['max'][name]
+                        entry['min'][name] = lower if current[0] is None else min(current[0], lower)
+                        entry['max'][name] = upper if current[1] is None else max(current[1], upper)
+            # the partition columns are not in the files
+            if entry['rows']:
+                missing.update(name for name in columns if name not in found)
+            statistics[_normalize(file)] = entry
+
+        missing = [name for name in columns if name in missing]
+        if missing:
+            aggregations = []
+            for name in missing:
+                aggregations.extend([min_(name).alias(f'min:{name}'), max_(name).alias(f'max:{name}')])
+            data = self.spark.read.option('basePath', path).parquet(*files)
+            rows = data.select(input_file_name().alias('_file'), *missing).groupBy('_file').agg(*aggregations).collect()
+            for row in rows:
+                entry = statistics[_normalize(row['_file'])]
+                for name in missing:
+                    entry['min'][name] = row[f'min:{name}']
+                    entry['max'][name] = row[f'max:{name}']
+        return schema, statistics
+
+    def write(self, path, spec, columns):
+        """Writes the manifest of a table.
+
+        Args:
+            path: The table path.
+            spec: The table PartitionSpec.
+            columns: The statistics columns.
+
+        Returns:
+            The number of files in the manifest.
+        """
+        previous = ManifestReader(self.storage, path).manifest or {'files': [], 'schema': None}
+        reused = {file['path']: file for file in previous['files']}
+        files = self.storage.list(spec.file_pattern(path))
+
+        pending = [file['path'] for file in files
+                   if file['path'] not in reused or reused[file['path']]['size'] != file['size']]
+        schema, statistics = previous['schema'], {}
+        if pending:
+            schema, statistics = self._file_statistics(path, pending, columns)
+            schema = schema.json()
+
+        entries = []
+        for file in files:
+            entry = statistics.get(file['path']) or reused.get(file['path'])
+            if entry is None:
+                continue
+            entries.append({'path': file['path'],
+                            'size': file['size'],
+                            'partition': _partition(file['path']),
+                            'rows': entry['rows'],
+                            'min': entry['min'],
+                            'max': entry['max']})
+
+        manifest = {'updated': datetime.now(timezone.utc).isoformat(),
+                    'partition_by': spec.partition_by,
+                    'columns': columns,
+                    'schema': schema,
+                    'files': entries}
+        self.storage.write_text(f'{path}/{MANIFEST_NAME}', json.dumps(manifest, indent=2, default=str))
+        return len(entries)
+
+
+class ManifestReader:
+    """This class defines the reader of a table manifest.
+
+    The files are pruned by the partition values and by the min and
+    max statistics of the manifest, and only the remaining file paths
+    are handed to Spark, without listing the table directories.
+
+    Usage example:
+
+    reader = ManifestReader(storage, 'data/silver/songplays/songplays.parquet')
+    songplays = reader.read(spark, partitions={'year': 2018, 'month': [11]},
+                            ranges={'user_id': ('10', '20')})
+    """
+
+    def __init__(self, storage, path):
+        """Creates the ManifestReader object and loads the manifest file.
+
+        Args:
+            storage: The file system adapter.
+            path: The table path.
+        """
+        self.path = path
+        text = storage.read_text(f'{path}/{MANIFEST_NAME}')
+        self.manifest = json.loads(text) if text is not None else None
+
+    @staticmethod
+    def _matches(file, partitions, ranges):
+        """Checks if a file may hold rows of the partitions and ranges."""
+        for name, values in partitions.items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            if file['partition'].get(name) not in {str(value) for value in values}:
+                return False
+
+        for name, (lower, upper) in ranges.items():
+            minimum, maximum = file['min'].get(name), file['max'].get(name)
+            if minimum is None or maximum is None:
+                continue
+            if (upper is not None and minimum > upper) or (lower is not None and maximum < lower):
+                return False
+        return True
+
+    def files(self, partitions=None, ranges=None):
+        """Returns the paths of the files that may hold the selected rows.
+
+        Args:
+            partitions: A dictionary of partition column names and
+                a value or a list of values. E.g. {'year': 2018}
+            ranges: A dictionary of statistics column names and an
+                inclusive (lower, upper) tuple, where None is unbounded.
+
+        Raises:
+            FileNotFoundError: If the table has no manifest.
+        """
+        if self.manifest is None:
+            raise FileNotFoundError(f'No manifest found for the table {self.path}')
+
+        return [file['path'] for file in self.manifest['files']
+                if self._matches(file, partitions or {}, ranges or {})]
+
+    def read(self, spark, partitions=None, ranges=None):
+        """Reads the pruned files of the table, with the same arguments as files.
+
+        Returns:
+            The DataFrame of the pruned files, that is empty when
+            no file matches.
+        """
+        files = self.files(partitions, ranges)
+        if not files:
+            schema = self.manifest['schema']
+            return spark.createDataFrame([], StructType.fromJson(json.loads(schema)) if schema else StructType())
+        return spark.read.option('basePath', self.path).parquet(*files)
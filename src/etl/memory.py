@@ -0,0 +1,123 @@
+"""Defines the MemoryBudget class to size a local Spark session by the
+host memory, and a helper function to report the peak memory."""
+
+# sys libs
+import os
+import resource
+
+CGROUP_LIMITS = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+"""The cgroup v2 and v1 memory limit files of containers, e.g. CI runners."""
+
+MB = 1024 * 1024
+"""The number of bytes in a megabyte."""
+
+
+def host_memory():
+    """Returns the memory available to the process in bytes, that is
+    the physical memory or the container limit when it is smaller."""
+    total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in CGROUP_LIMITS:
+        try:
+            with open(path, encoding='utf-8') as file:
+                limit = file.read().strip()
+        except OSError:
+            continue
+        # the unlimited cgroup v2 value is max
+        if limit.isdigit():
+            total = min(total, int(limit))
+    return total
+
+
+def peak_memory(spark):
+    """Reads the peak memory used by the driver JVM and python process.
+
+    The JVM peaks come from the MemoryPoolMXBeans, so the sum of the
+    pools is an upper bound of the peak, as the pools may peak at
+    different times. In local mode the executors run in the driver JVM.
+
+    Args:
+        spark: The Spark session.
+
+    Returns:
+        A dictionary with the heap, non-heap and python peaks and the
+        peak of each memory pool, in megabytes.
+    """
+    management = spark.sparkContext._jvm.java.lang.management.ManagementFactory
+    peaks = {'heap_mb': 0.0, 'non_heap_mb': 0.0, 'pools': {}}
+
+    for pool in management.getMemoryPoolMXBeans():
+        used = pool.getPeakUsage().getUsed() / MB
+        kind = 'heap_mb' if pool.getType().toString() == 'Heap memory' else 'non_heap_mb'
+        peaks[kind] += used
+        peaks['pools'][pool.getName()] = round(used, 2)
+
+    # the max resident set size is in kilobytes on linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peaks['python_mb'] = round(rss / (MB if os.uname().sysname == 'Darwin' else 1024), 2)
+    peaks['heap_mb'] = round(peaks['heap_mb'], 2)
+    peaks['non_heap_mb'] = round(peaks['non_heap_mb'], 2)
+    return peaks
+
+
+class MemoryBudget:
+    """This class defines the memory settings of a bounded local session.
+
+    The driver heap, where the local executors run, and the off-heap
+    memory are fractions of the host memory. The input partitions and
+    the row buffers of the window and sort-merge join operators, that
+    spill to disk when full, are sized by the heap of each core, so
+    the tasks spill early rather than run out of memory.
+
+    Usage example:
+
+    budget = MemoryBudget.from_config(config)
+    builder = budget.configure(SparkSession.builder)
+    """
+
+    def __init__(self, host_bytes, heap_fraction, off_heap_fraction, cores=None):
+        """Creates the MemoryBudget object.
+
+        Args:
+            host_bytes: The host memory in bytes.
+            heap_fraction: The fraction of the host memory of the driver heap.
+            off_heap_fraction: The fraction of the host memory of the
+                off-heap memory, where 0 disables it.
+            cores: The number of concurrent tasks, defaults to the host cores.
+
+        Raises:
+            ValueError: If the fractions leave no memory to the host.
+        """
+        if heap_fraction + off_heap_fraction >= 1:
+            raise ValueError('The sum of the heap and off-heap fractions must be lower than 1')
+
+        cores = cores or os.cpu_count() or 1
+        heap = max(512, int(host_bytes * heap_fraction / MB))
+        off_heap = int(host_bytes * off_heap_fraction / MB)
+        # Spark reserves 300 MB of the heap and executes the tasks in 60% of the rest
+        task_memory = max(1, (heap - 300) * 0.6 / cores)
+
+        self.host_mb = round(host_bytes / MB)
+        self.settings = {
+            'spark.driver.memory': f'{heap}m',
+            'spark.driver.maxResultSize': f'{max(64, heap // 4)}m',
+            'spark.memory.offHeap.enabled': str(off_heap > 0).lower(),
+            'spark.memory.offHeap.size': f'{off_heap}m',
+            'spark.sql.files.maxPartitionBytes': f'{min(128, max(8, int(task_memory // 4)))}m',
+            # the row buffers spill at about one row by kilobyte of task memory
+            'spark.sql.windowExec.buffer.spill.threshold': str(int(task_memory * 1024)),
+            'spark.sql.sortMergeJoinExec.buffer.spill.threshold': str(int(task_memory * 1024))
+        }
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the MemoryBudget object from the MEMORY config section."""
+        return cls(host_memory(),
+                   heap_fraction=config.getfloat('MEMORY', 'HEAP_FRACTION'),
+                   off_heap_fraction=config.getfloat('MEMORY', 'OFF_HEAP_FRACTION'))
+
+    def configure(self, builder):
+        """Adds all memory settings to a SparkSession builder, before
+        the driver JVM starts."""
+        for key, value in self.settings.items():
+            builder = builder.config(key, value)
+        return builder
@@ -0,0 +1,273 @@
+"""Defines the MergeWriter class to upsert the rows of a dimension
+table, rewriting only the Parquet files that hold changed keys."""
+
+# sys libs
+import uuid
+# data libs
+import json
+# spark libs
+from pyspark.sql.functions import broadcast, col, current_timestamp, input_file_name, lit, when, xxhash64
+from pyspark.sql.functions import max as max_, min as min_
+from pyspark.sql.types import TimestampType
+# storage libs
+from etl.manifest import ManifestReader, _normalize
+
+SCD2_COLUMNS = ['effective_from', 'effective_to', 'is_current']
+"""The history columns added to the type 2 slowly changing dimensions."""
+
+COMMIT_NAME = '_merge_commit.json'
+"""The pending merge commit file in the table folder, ignored by Spark readers."""
+
+
+class MergeWriter:
+    """This class defines the merge (upsert) writer of the dimensions.
+
+    The incoming rows identical to the current rows are ignored. The
+    remaining rows are changes, inserts or updates. The files of the
+    existing table that hold the keys of the updates are found by a
+    scan of the key columns, pruned by the min and max statistics of
+    the table manifest, and only those files are rewritten:
+
+    - type 1: the old rows of the changed keys are replaced.
+    - type 2: the old rows are kept with their effective_to set
+      and is_current false, and the new rows are added as current.
+
+    The inserts are written into new files with the rewritten rows.
+    The staged files to move into the table and the rewritten files
+    to delete are saved in a commit file first, so a merge that fails
+    in between is completed by the next merge. A type 1 table merged
+    as a type 2 dimension is rewritten once with the history columns.
+
+    Usage example:
+
+    merger = MergeWriter(spark, storage, writer)
+    merger.merge(users, path, PartitionSpec(), keys=['user_id'], scd2=True)
+    """
+
+    def __init__(self, spark, storage, writer):
+        """Creates the MergeWriter object.
+
+        Args:
+            spark: The Spark session.
+            storage: The file system adapter.
+            writer: The TableWriter of the staged files.
+        """
+        self.spark = spark
+        self.storage = storage
+        self.writer = writer
+
+    @staticmethod
+    def _row_hash(columns):
+        """Returns the hash of the values of the given columns."""
+        return xxhash64(*[col(name) for name in columns])
+
+    @staticmethod
+    def _history(data, effective_from):
+        """Adds the current row history columns to the new rows."""
+        return data \
+            .withColumn('effective_from', effective_from) \
+            .withColumn('effective_to', lit(None).cast(TimestampType())) \
+            .withColumn('is_current', lit(True))
+
+    def _read_files(self, path, files, scd2=False):
+        """Reads a list of Parquet files of a table with its partition columns.
+
+        The rows of a type 1 table read as a type 2 dimension get the
+        history columns of current rows, with an unknown effective_from.
+        """
+        table = self.spark.read.option('basePath', path).parquet(*files)
+        if scd2 and not set(SCD2_COLUMNS) <= set(table.columns):
+            table = self._history(table, lit(None).cast(TimestampType()))
+        return table
+
+    @staticmethod
+    def _current(table, scd2):
+        """Filters the current rows of a type 2 dimension."""
+        return table.where(col('is_current')) if scd2 else table
+
+    def _candidates(self, path, spec, data, keys):
+        """Lists the files of a table that may hold the keys of the data.
+
+        With a single key column, the files whose min and max key
+        statistics in the table manifest hold none of the keys are
+        skipped. The files missing from the manifest, or changed since
+        it was written, are always candidates.
+
+        Returns:
+            The list of file paths.
+        """
+        files = self.storage.list(spec.file_pattern(path))
+        manifest = ManifestReader(self.storage, path).manifest
+        if len(keys) != 1 or manifest is None:
+            return [file['path'] for file in files]
+
+        key = keys[0]
+        entries = {entry['path']: entry for entry in manifest['files']}
+        candidates, ranges = [], []
+        for file in files:
+            entry = entries.get(file['path'])
+            if entry is None or entry['size'] != file['size'] or entry['min'].get(key) is None:
+                candidates.append(file['path'])
+            else:
+                ranges.append((file['path'], str(entry['min'][key]), str(entry['max'][key])))
+
+        if ranges:
+            key_type = data.schema[key].dataType
+            bounds = self.spark.createDataFrame(ranges, '_file string, _min string, _max string') \
+                .select('_file', col('_min').cast(key_type).alias('_min'), col('_max').cast(key_type).alias('_max'))
+            matched = data.select(key).distinct() \
+                .join(broadcast(bounds), col(key).between(col('_min'), col('_max'))) \
+                .select('_file').distinct().collect()
+            candidates.extend(row['_file'] for row in matched)
+        return candidates
+
+    def _files(self, path, files, data, keys, scd2):
+        """Finds the files of a table that hold the keys of the data.
+
+        Only the key columns of the candidate files are read, and the
+        min and max of a single key column skip the Parquet row groups
+        out of the key range.
+
+        Args:
+            path: The table path.
+            files: The list of candidate file paths.
+            data: The DataFrame with the keys.
+            keys: The list of key columns.
+            scd2: Defines if only the current rows are searched.
+
+        Returns:
+            The list of file paths.
+        """
+        if not files:
+            return []
+
+        # the file name is only available before the rows are shuffled
+        candidates = self._current(self._read_files(path, files, scd2), scd2) \
+            .select(*keys, input_file_name().alias('_file'))
+        if len(keys) == 1:
+            lower, upper = data.agg(min_(keys[0]), max_(keys[0])).first()
+            if lower is not None:
+                candidates = candidates.where(col(keys[0]).between(lower, upper))
+
+        # the file names are percent-encoded URIs, read again and deleted as listed paths
+        return [_normalize(row['_file']) for row in candidates.join(data.select(keys), keys, 'left_semi')
+                .select('_file').distinct().collect()]
+
+    @staticmethod
+    def _close(rows, keys, changed_keys, effective_to):
+        """Closes the current rows of the changed keys of a type 2 dimension."""
+        changed = changed_keys.withColumn('_changed', lit(True))
+        closed = col('_changed').isNotNull() & col('is_current')
+
+        return rows.join(changed, keys, 'left') \
+            .withColumn('effective_to', when(closed, effective_to).otherwise(col('effective_to'))) \
+            .withColumn('is_current', col('is_current') & ~closed) \
+            .drop('_changed')
+
+    def _recover(self, path):
+        """Completes the pending merge commit of a table, if any.
+
+        The moves and deletes are idempotent, so the commit file is
+        only deleted when all of them are done.
+
+        Returns:
+            True if a pending commit was completed.
+        """
+        commit_path = f'{path}/{COMMIT_NAME}'
+        text = self.storage.read_text(commit_path)
+        if text is None:
+            return False
+
+        commit = json.loads(text)
+        for source, target in commit['moves']:
+            if self.storage.exists(source):
+                self.storage.rename(source, target)
+        for file in commit['deletes']:
+            self.storage.delete(file)
+        self.storage.delete(commit['staging'])
+        self.storage.delete(commit_path)
+        return True
+
+    def _commit(self, path, spec, staging, files):
+        """Moves the staged files into the table and deletes the
+        rewritten files, after saving both lists in the commit file.
+
+        Args:
+            path: The table path.
+            spec: The table PartitionSpec.
+            staging: The path of the staged files.
+            files: The list of rewritten file paths.
+        """
+        moves = []
+        for file in self.storage.list(spec.file_pattern(staging)):
+            # the partition directories are the last components of the staged file path
+            directories = file['path'].split('/')[-1 - len(spec.partition_by):-1]
+            name = f'part-merged-{uuid.uuid4().hex}.parquet'
+            moves.append([file['path'], '/'.join([path, *directories, name])])
+
+        commit = {'staging': staging, 'moves': moves, 'deletes': files}
+        self.storage.write_text(f'{path}/{COMMIT_NAME}', json.dumps(commit, indent=2))
+        self._recover(path)
+
+    def merge(self, data, path, spec, keys, scd2=False):
+        """Upserts the incoming rows into the table.
+
+        Args:
+            data: The DataFrame with one row by key.
+            path: The table path.
+            spec: The table PartitionSpec.
+            keys: The list of key columns.
+            scd2: Defines if the history of the changed rows is kept.
+
+        Returns:
+            A dictionary with the number of changed rows and
+            the number of files rewritten.
+        """
+        effective_from = current_timestamp()
+
+        if self._recover(path):
+            print(f'WARN: Completed the interrupted merge commit of {path}')
+
+        if not self.storage.exists(path):
+            self.writer.write(self._history(data, effective_from) if scd2 else data, path, spec)
+            return {'changes': None, 'rewritten_files': 0}
+
+        # a type 1 table merged as a type 2 dimension is rewritten with the history columns
+        upgrade = scd2 and not set(SCD2_COLUMNS) <= set(self.spark.read.parquet(path).columns)
+        if upgrade:
+            files = [file['path'] for file in self.storage.list(spec.file_pattern(path))]
+        else:
+            files = self._files(path, self._candidates(path, spec, data, keys), data, keys, scd2)
+
+        changes = data
+        if files:
+            hashed = self._current(self._read_files(path, files, scd2), scd2) \
+                .select(self._row_hash(data.columns).alias('_hash'))
+            changes = data.withColumn('_hash', self._row_hash(data.columns)) \
+                .join(hashed, '_hash', 'left_anti') \
+                .drop('_hash')
+
+        changes = changes.persist()
+        num_changes = changes.count()
+        if not num_changes and not upgrade:
+            changes.unpersist()
+            return {'changes': 0, 'rewritten_files': 0}
+
+        staged = self._history(changes, effective_from) if scd2 else changes
+        if files and not upgrade:
+            # only the files that hold the keys of the changed rows are rewritten
+            files = self._files(path, files, changes, keys, scd2)
+        if files:
+            rewritten = self._read_files(path, files, scd2)
+            if scd2:
+                rewritten = self._close(rewritten, keys, changes.select(keys), effective_from)
+            else:
+                rewritten = rewritten.join(changes.select(keys), keys, 'left_anti')
+            staged = staged.unionByName(rewritten.select(staged.columns))
+
+        staging = f'{path}/_merge_{uuid.uuid4().hex}'
+        self.writer.write(staged, staging, spec)
+        changes.unpersist()
+
+        self._commit(path, spec, staging, files)
+        return {'changes': num_changes, 'rewritten_files': len(files)}
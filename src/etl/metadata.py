@@ -63,6 +63,76 @@ columns = {
     'users': {
         'json': ['userId', 'firstName', 'lastName', 'gender', 'level'],
         'table': ['user_id', 'first_name', 'last_name', 'gender', 'level']
+    },
+    'daily_song_plays': {
+        'json': [],
+        'table': ['date', 'song_id', 'artist_id', 'plays', 'listeners', 'year', 'month']
+    },
+    'hourly_active_users': {
+        'json': [],
+        'table': ['date', 'hour', 'level', 'active_users', 'plays', 'year', 'month']
     }
 }
 """Defines the lists of columns for each table."""
+
+lookup = ['song_id', 'title', 'duration', 'artist_id', 'artist_name']
+"""Defines the song data columns of the song lookup dimension,
+that is joined with the songplays."""
+
+ordering = {
+    'users': ['ts']
+}
+"""Defines the columns that pick the latest row of each key when
+deduplicating a table, e.g. the latest user level."""
+
+keys = {
+    'artists': ['artist_id'],
+    'daily_song_plays': ['year', 'month', 'date', 'song_id', 'artist_id'],
+    'hourly_active_users': ['year', 'month', 'date', 'hour', 'level'],
+    'songplays': ['year', 'month', 'songplay_id'],
+    'songs': ['song_id'],
+    'time': ['year', 'month', 'start_time'],
+    'users': ['user_id']
+}
+"""Defines the lists of columns that identify a row of each table.
+
+The partition columns are part of the time and songplays keys, so
+the incremental merge only scans the partitions of the new rows.
+"""
+
+references = {
+    'songplays': {'song_id': 'songs', 'artist_id': 'artists'}
+}
+"""Defines the columns that reference a dimension table and the name
+of the dimension table, that has a column of the same name, e.g. the
+song_id of the songplays that must be in the songs table."""
+
+statistics = {
+    'artists': ['artist_id'],
+    'daily_song_plays': ['date', 'song_id'],
+    'hourly_active_users': ['date'],
+    'songplays': ['start_time', 'user_id', 'song_id'],
+    'songs': ['song_id', 'artist_id'],
+    'time': ['start_time'],
+    'users': ['user_id']
+}
+"""Defines the columns whose min and max values by file are saved
+in the table manifest, so the readers can prune the files."""
+
+rollups = {
+    'daily_song_plays': {
+        'condition': 'song_id IS NOT NULL',
+        'dimensions': {'date': 'to_date(start_time)', 'song_id': 'song_id', 'artist_id': 'artist_id'},
+        'measures': {'plays': 'count(1)', 'listeners': 'count(DISTINCT user_id)'}
+    },
+    'hourly_active_users': {
+        'condition': None,
+        'dimensions': {'date': 'to_date(start_time)', 'hour': 'hour(start_time)', 'level': 'level'},
+        'measures': {'active_users': 'count(DISTINCT user_id)', 'plays': 'count(1)'}
+    }
+}
+"""Defines the gold rollup tables of the songplays, selected by the
+GOLD.ROLLUPS option, with the SQL expressions of the optional row
+filter, the dimensions and the measures. The rollups are grouped by
+the year and month of the songplays too, so each month partition
+can be refreshed alone."""
@@ -0,0 +1,197 @@
+"""Defines the MetricsCollector class to record the Spark metrics
+of each pipeline phase and table as a JSON metrics document."""
+
+# sys libs
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+from urllib.error import URLError
+from urllib.request import urlopen
+# data libs
+import json
+
+STAGE_METRICS = {
+    'rows_in': 'inputRecords',
+    'rows_out': 'outputRecords',
+    'shuffle_read_bytes': 'shuffleReadBytes',
+    'shuffle_write_bytes': 'shuffleWriteBytes',
+    'memory_spilled_bytes': 'memoryBytesSpilled',
+    'disk_spilled_bytes': 'diskBytesSpilled',
+    'executor_cpu_time_ms': 'executorCpuTime'
+}
+"""Maps the metric names to the Spark REST API stage data fields."""
+
+
+class MetricsCollector:
+    """This class defines the pipeline instrumentation.
+
+    Every block of code executed inside a stage context runs its
+    Spark jobs in a job group named after the phase and the table.
+    After the run, the stage metrics of each job group are read from
+    the Spark monitoring REST API, or from the status tracker when
+    the Spark UI is disabled, and saved as a JSON document.
+
+    Usage example:
+
+    metrics = MetricsCollector(spark, storage, 'data/metrics')
+    with metrics.stage('load', 'songs'):
+        songs.write.parquet(path)
+    metrics.save()
+    """
+
+    def __init__(self, spark, storage, path, prefix=None):
+        """Creates the MetricsCollector object.
+
+        Args:
+            spark: The Spark session.
+            storage: The file system adapter.
+            path: The directory of the JSON metrics documents.
+            prefix: The optional job group prefix, that separates the
+                jobs of the runs sharing a Spark application.
+        """
+        self.spark = spark
+        self.storage = storage
+        self.path = path
+        self.prefix = prefix
+        self.records = []
+        self.started = datetime.now(timezone.utc)
+
+    @contextmanager
+    def stage(self, phase, table=None):
+        """Runs a block of code in the job group of a phase and table.
+
+        Args:
+            phase: The pipeline phase. E.g. load
+            table: The optional table name. E.g. songs
+
+        Yields:
+            The stage record, where extra values can be added.
+        """
+        context = self.spark.sparkContext
+        group = f'{phase}:{table}' if table else phase
+        group = f'{self.prefix}/{group}' if self.prefix else group
+        previous = context.getLocalProperty('spark.jobGroup.id')
+        record = {'phase': phase, 'table': table, 'group': group}
+
+        context.setLocalProperty('spark.jobGroup.id', group)
+        context.setLocalProperty('spark.job.description', group)
+        start = timer()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = round(timer() - start, 3)
+            context.setLocalProperty('spark.jobGroup.id', previous)
+            context.setLocalProperty('spark.job.description', previous)
+            self.records.append(record)
+
+    def wall_time(self, phase):
+        """Returns the wall time in seconds of a phase."""
+        return sum(record['wall_time'] for record in self.records
+                   if record['phase'] == phase and record['table'] is None)
+
+    def _request(self, endpoint):
+        """Reads an endpoint of the Spark monitoring REST API."""
+        context = self.spark.sparkContext
+        url = f'{context.uiWebUrl}/api/v1/applications/{context.applicationId}/{endpoint}'
+        with urlopen(url, timeout=10) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def _stage_metrics(self, stage_ids):
+        """Sums the REST API metrics of a list of stages and computes
+        the task skew as the max by median task run time ratio."""
+        metrics = {name: 0 for name in STAGE_METRICS}
+        metrics.update({'stages': 0, 'tasks': 0, 'task_skew': 1.0})
+
+        for stage_id in stage_ids:
+            try:
+                attempts = self._request(f'stages/{stage_id}')
+            except URLError:
+                # skipped stages, whose shuffle output was reused, are not listed
+                continue
+
+            for attempt in attempts:
+                metrics['stages'] += 1
+                metrics['tasks'] += attempt.get('numTasks', 0)
+                for name, field in STAGE_METRICS.items():
+                    metrics[name] += attempt.get(field, 0)
+
+                try:
+                    summary = self._request(f"stages/{stage_id}/{attempt['attemptId']}"
+                                            f"/taskSummary?quantiles=0.5,1.0")
+                except URLError:
+                    continue
+
+                median, maximum = summary.get('executorRunTime', [0, 0])
+                if median:
+                    metrics['task_skew'] = max(metrics['task_skew'], round(maximum / median, 2))
+
+        # the REST API reports the executor CPU time in nanoseconds
+        metrics['executor_cpu_time_ms'] = metrics['executor_cpu_time_ms'] // 1000000
+        return metrics
+
+    def _tracker_metrics(self, group):
+        """Reads the job, stage and task counts of a job group from
+        the status tracker, used when the Spark UI is disabled."""
+        tracker = self.spark.sparkContext.statusTracker()
+        metrics = {'jobs': 0, 'stages': 0, 'tasks': 0, 'failed_tasks': 0}
+
+        for job_id in tracker.getJobIdsForGroup(group):
+            job = tracker.getJobInfo(job_id)
+            metrics['jobs'] += 1
+            for stage_id in job.stageIds if job else []:
+                stage = tracker.getStageInfo(stage_id)
+                if stage:
+                    metrics['stages'] += 1
+                    metrics['tasks'] += stage.numTasks
+                    metrics['failed_tasks'] += stage.numFailedTasks
+        return metrics
+
+    def collect(self):
+        """Adds the Spark metrics of its job group to each stage record."""
+        try:
+            jobs = self._request('jobs') if self.spark.sparkContext.uiWebUrl else None
+        except URLError as error:
+            print(f'WARN: Spark REST API unavailable, using the status tracker: {error}')
+            jobs = None
+
+        for record in self.records:
+            if jobs is None:
+                record.update(self._tracker_metrics(record['group']))
+                continue
+
+            group_jobs = [job for job in jobs if job.get('jobGroup') == record['group']]
+            stage_ids = sorted({stage_id for job in group_jobs for stage_id in job['stageIds']})
+            record['jobs'] = len(group_jobs)
+            record.update(self._stage_metrics(stage_ids))
+
+    def document(self, stats=None):
+        """Returns the metrics document of the run.
+
+        Args:
+            stats: The optional pipeline run statistics.
+        """
+        context = self.spark.sparkContext
+        return {
+            'application_id': context.applicationId,
+            'application_name': context.appName,
+            'started': self.started.isoformat(),
+            'phases': {record['phase']: record['wall_time']
+                       for record in self.records if record['table'] is None},
+            'stages': self.records,
+            'stats': stats or {}
+        }
+
+    def save(self, stats=None):
+        """Collects the Spark metrics and writes the metrics document.
+
+        Args:
+            stats: The optional pipeline run statistics.
+
+        Returns:
+            The path of the JSON metrics document.
+        """
+        self.collect()
+        timestamp = self.started.strftime('%Y%m%dT%H%M%S')
+        path = f'{self.path}/metrics-{timestamp}-{self.spark.sparkContext.applicationId}.json'
+        self.storage.write_text(path, json.dumps(self.document(stats), indent=2))
+        return path
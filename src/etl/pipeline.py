@@ -3,15 +3,35 @@ the AWS S3 bucket, transform them with Spark, and load
 them back into S3 as a set of dimensional parquet tables."""
 
 # sys libs
-from timeit import default_timer as timer
+import math
+from functools import partial
 # data libs
 import json
 # spark libs
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, concat, concat_ws, from_unixtime, substring, to_date
+from pyspark.sql.functions import col, expr, from_unixtime, to_date
 from pyspark.sql.functions import dayofmonth, dayofweek, hour, month, weekofyear, year
 # metadata libs
-from etl.metadata import columns, schema
+from etl.metadata import columns, keys, lookup, ordering, references, rollups, schema, statistics
+# storage libs
+from etl.backend import songplay_id, start_time
+from etl.cache import DimensionCache
+from etl.dedup import deduplicate
+from etl.explain import PlanReport
+from etl.incremental import Watermark
+from etl.merge import MergeWriter
+from etl.join import LOOKUP_VERSION, SongLookup
+from etl.manifest import ManifestWriter
+from etl.memory import MemoryBudget, peak_memory
+from etl.metrics import MetricsCollector
+from etl.quality import QualityCheck
+from etl.registry import DagExecutor, TableDefinition, TableRegistry
+from etl.sizing import estimate_bytes
+from etl.smallfiles import SmallFileMerger
+from etl.storage import Storage
+from etl.tuning import TuningProfile, estimate_input
+from etl.writer import TableWriter
 
 
 class ETLPipeline:
@@ -27,311 +47,990 @@ class ETLPipeline:
     python -m etl --local
     """
 
-    def __init__(self, config):
+    def __init__(self, config, spark=None, name=None):
         """Creates the ETLPipeline object and sets the config object.
 
         Args:
             config: The config adapter wrapper.
+            spark: An optional Spark session shared with other runs,
+                that is not stopped by the pipeline.
+            name: The optional run name, that prefixes the job groups.
         """
         self.config = config
-        self.spark = self._create_spark_session()
+        self.stats = {}
+        self.shared_session = spark is not None
+        self.spark = self._create_spark_session(spark)
+        self.storage = Storage(self.spark)
+        self.incremental = config.getboolean('PIPELINE', 'INCREMENTAL')
+        self.bounded = config.getboolean('MEMORY', 'BOUNDED')
+        self.watermark = None
+        self.lookup = SongLookup.from_config(config)
+        self.persisted = []
+        self.metrics = MetricsCollector(self.spark, self.storage, config.get('S3', 'METRICS'), prefix=name)
+        self.writer = TableWriter.from_config(self.spark, self.storage, config)
+        self.quality = QualityCheck.from_config(config)
+        self.merger = MergeWriter(self.spark, self.storage, self.writer)
+        self.manifests = ManifestWriter(self.spark, self.storage)
+        self.registry = self._create_registry()
+        self.selection = config.getlist('PIPELINE', 'TABLES')
+        self.cache = None
+        self.cache_key = None
+        self.cached_lookup = None
+        self.dry_run = False
 
-    def _create_spark_session(self):
-        """Creates the Spark session and sets the application name."""
-        spark = SparkSession.builder \
-            .appName(self.config.get('SPARK', 'APP_NAME')) \
-            .getOrCreate()
+        if self.incremental:
+            manifest = f"{config.get('S3', 'MANIFEST')}/{config.get('FILES', 'WATERMARK')}"
+            self.watermark = Watermark(self.storage, manifest)
+        elif config.getboolean('CACHE', 'ENABLED'):
+            self.cache = DimensionCache.from_config(self.spark, self.storage, config)
 
-        if not self.config.local:
-            spark.sparkContext.setLogLevel('WARN')
+    def _create_spark_session(self, spark=None):
+        """Creates the Spark session and sets the application name,
+        the scheduler mode and the settings of the tuning profile.
+
+        The profile is selected before the session starts when it is
+        set in SPARK.PROFILE or when the input is on the local file
+        system. Otherwise the S3 input is measured by the session
+        and only the runtime settings of the profile are applied.
+
+        Args:
+            spark: An optional running Spark session, where only the
+                runtime settings of the profile are applied.
+        """
+        patterns = [self._input_pattern('LOGS'), self._input_pattern('SONGS')]
+
+        profile = None
+        if spark is None:
+            builder = SparkSession.builder \
+                .appName(self.config.get('SPARK', 'APP_NAME'))
+
+            explicit = self.config.get('SPARK', 'PROFILE').lower() != 'auto'
+            if explicit or Storage.is_local(patterns[0]):
+                input_size = 0 if explicit else estimate_input(Storage(), patterns)
+                profile = TuningProfile.select(self.config, input_size)
+                builder = profile.configure(builder)
+
+            # the parallel load submits each table write to its own FAIR pool
+            if self.config.getboolean('LOAD', 'PARALLEL'):
+                builder = builder.config('spark.scheduler.mode', 'FAIR')
+
+            # the local executors run in the driver JVM sized by the host memory
+            if self.config.local and self.config.getboolean('MEMORY', 'BOUNDED'):
+                budget = MemoryBudget.from_config(self.config)
+                builder = budget.configure(builder)
+                print(f'INFO: Memory bounded session of a {budget.host_mb} MB host.')
+                for key, value in budget.settings.items():
+                    print(f'INFO: {key}={value}')
+
+            spark = builder.getOrCreate()
+
+            if not self.config.local:
+                spark.sparkContext.setLogLevel('WARN')
+
+        if profile is None:
+            profile = TuningProfile.select(self.config, estimate_input(Storage(spark), patterns))
+            for key in profile.apply(spark):
+                print(f'WARN: {key} must be set before the session starts, use spark-submit --conf.')
+
+        print(f'INFO: Spark tuning profile {profile.name}.')
+        for key in profile.settings:
+            print(f'INFO: {key}={spark.conf.get(key, None)}')
+        self.stats['tuning_profile'] = profile.name
 
         return spark
 
-    def _read(self, source, schema):
-        """Reads the JSON file that was merged by
-        the AWS S3DistCp on cluster bootstrap.
+    def _create_registry(self):
+        """Declares the silver tables, their inputs and transformations.
+
+        The inputs are the songs, the enriched logs and the song
+        lookup sources, built by the transform phase, or other tables.
+        With GOLD.ENABLED, the GOLD.ROLLUPS tables of the songplays
+        are declared in the gold layer.
+
+        Raises:
+            ValueError: If a rollup is unknown or not partitioned by month.
+        """
+        registry = TableRegistry()
+        registry.register(TableDefinition(
+            'artists', inputs=['songs'], keys=keys['artists'],
+            transform=partial(self._transform_table,
+                              json_columns=columns['artists']['json'],
+                              table_columns=columns['artists']['table'],
+                              duplicates=['artist_id'])))
+        registry.register(TableDefinition(
+            'songs', inputs=['songs'], keys=keys['songs'],
+            transform=partial(self._transform_table,
+                              json_columns=columns['songs']['json'],
+                              table_columns=columns['songs']['table'],
+                              duplicates=['song_id'])))
+        registry.register(TableDefinition(
+            'users', inputs=['logs'], keys=keys['users'],
+            transform=partial(self._transform_table,
+                              json_columns=columns['users']['json'],
+                              table_columns=columns['users']['table'],
+                              duplicates=['user_id'],
+                              order_by=ordering['users'])))
+        registry.register(TableDefinition(
+            'time', inputs=['logs'], keys=keys['time'],
+            transform=partial(self._transform_time,
+                              table_columns=columns['time']['table'],
+                              duplicates=['start_time'])))
+        registry.register(TableDefinition(
+            'songplays', inputs=['logs', 'lookup'], keys=keys['songplays'],
+            transform=partial(self._transform_songplays,
+                              json_columns=columns['songplays']['json'],
+                              table_columns=columns['songplays']['table'])))
+
+        for name in self.config.getlist('GOLD', 'ROLLUPS') if self.config.getboolean('GOLD', 'ENABLED') else []:
+            if name not in rollups:
+                raise ValueError(f"Unknown rollup {name}, the rollups are {', '.join(rollups)}")
+            definition = TableDefinition(
+                name, inputs=['songplays'], keys=keys[name], layer='GOLD',
+                transform=partial(self._transform_rollup, table_columns=columns[name]['table'], **rollups[name]))
+            # each refresh overwrites the month partitions of the new songplays
+            if not {'year', 'month'} <= set(definition.partition_spec(self.config).partition_by):
+                raise ValueError(f'The {name} rollup must be partitioned by year and month')
+            registry.register(definition)
+        return registry
+
+    def _read(self, pattern, schema):
+        """Reads the JSON input files with the given schema.
+
+        On AWS EMR, unless the small files stage is enabled, the
+        input files were merged by the AWS S3DistCp on cluster
+        bootstrap and are read through S3 Select.
 
         Args:
-            source: The origin folder of the JSON file.
+            pattern: The glob pattern of the JSON files.
+            schema: The JSON files schema.
         """
-        json_data = f"{self.config.get('S3', 'BRONZE')}/{source}"
+        if self.config.local or self.config.getboolean('SMALL_FILES', 'ENABLED'):
+            return self.spark.read.json(pattern, schema=schema)
 
         return self.spark.read.format('s3selectJson') \
-            .option('multiline', True).load(json_data, schema=schema)
+            .option('multiline', True).load(pattern, schema=schema)
+
+    def _write_bronze(self, data, target, mode='overwrite'):
+        """Writes the typed JSON data as Parquet files in the bronze layer.
+
+        The number of files is the estimated size of the input JSON
+        divided by BRONZE.TARGET_FILE_SIZE_MB. As Parquet is compressed
+        and columnar, the files come out smaller than the target size.
+
+        Args:
+            data: The DataFrame read from the JSON files.
+            target: The bronze Parquet folder.
+            mode: The parquet write mode, overwrite or append.
 
-    def _repartition(self, source, target, schema, multiline=False):
-        """Reads all json files in the source folder and
-        merge them into one JSON file in the target folder.
+        Returns:
+            The list of Parquet files written.
+        """
+        target_size = self.config.getint('BRONZE', 'TARGET_FILE_SIZE_MB') * 1024 * 1024
+        num_files = max(1, math.ceil(estimate_bytes(data) / target_size))
+        existing = {file['path'] for file in self.storage.list(f'{target}/*.parquet')}
+
+        data.repartition(num_files).write.mode(mode).parquet(target)
+
+        return [file['path'] for file in self.storage.list(f'{target}/*.parquet')
+                if file['path'] not in existing]
 
-        NOTE: The number of partitions was set to ONE just
-        because the data set is small and the merged JSON
-        file has less than 128 MB.
+    def _bronze_path(self, name):
+        """Returns the bronze Parquet folder of a source.
 
         Args:
-            source: The origin folder of the json files.
-            target: The destination folder for the JSON file.
-            multiline: Flag the JSON read file format.
+            name: The FILES option prefix. E.g. LOGS or SONGS
         """
-        data = self.spark.read.json(source, schema=schema).repartition(1)
-        data.write.mode('overwrite').json(target)
-        return self.spark.read.json(target)
+        return f"{self.config.get('S3', 'BRONZE')}/{self.config.get('FILES', f'{name}_BRONZE')}"
 
-    def _extract(self, source, target, schema, multiline=False):
-        """Reads JSON data files from the landing zone and merges them,
-        by repartitioning, into a single file in the bronze layer.
+    def _input_pattern(self, name):
+        """Returns the glob pattern of the input JSON files.
+
+        Args:
+            name: The FILES option prefix. E.g. LOGS or SONGS
+        """
+        if self.config.local or self.config.getboolean('SMALL_FILES', 'ENABLED'):
+            return f"{self.config.get('S3', 'LANDING')}/{self.config.get('FILES', f'{name}_LANDING')}"
+        return f"{self.config.get('S3', 'BRONZE')}/{self.config.get('FILES', f'{name}_BRONZE_S3')}"
+
+    def _merge_small_files(self, name, pattern):
+        """Merges the small JSON input files into target sized
+        JSON lines files in the bronze layer.
+
+        Args:
+            name: The FILES option prefix. E.g. LOGS or SONGS
+            pattern: The glob pattern of the JSON input files.
 
         Returns:
-            The merged JSON file.
+            The glob pattern of the merged files.
         """
-        landing = f"{self.config.get('S3', 'LANDING')}/{source}"
-        bronze = f"{self.config.get('S3', 'BRONZE')}/{target}"
+        target = f"{self.config.get('S3', 'BRONZE')}/{self.config.get('FILES', f'{name}_MERGED')}"
+        merged = SmallFileMerger.from_config(self.storage, self.config).merge(pattern, target)
+        self.stats[f'{name.lower()}_batches'] = merged
+        return f'{target}/*.json'
 
-        return self._repartition(source=landing, target=bronze,
-                                 schema=schema, multiline=multiline)
+    def _extract(self, name, schema):
+        """Reads the JSON input files and stores them as typed Parquet
+        files in the bronze layer.
 
-    @staticmethod
-    def _transform_table(data, json_columns, table_columns, duplicates=None):
-        """Renames all columns of a DataFrame and drop duplicate values
-        for the given list of columns with duplicates.
+        The input files listing is saved with the Parquet files, so
+        when the input did not change the next runs read the bronze
+        Parquet files without parsing the JSON files again.
 
         Args:
-            data: The table DataFrame
-            json_columns: Column names from spark infer schema.
-            table_columns: Column names to write to the parquet file.
-            duplicates: List of columns to drop duplicate values.
+            name: The FILES option prefix. E.g. LOGS or SONGS
+            schema: The JSON files schema.
 
         Returns:
-            The transformed table DataFrame.
+            The DataFrame read from the bronze Parquet files, or from
+            the JSON files in a dry run when they changed.
+        """
+        pattern = self._input_pattern(name)
+        bronze = self._bronze_path(name)
+        # spark ignores files starting with underscore in the parquet folder
+        marker = f'{bronze}/_inputs.json'
+        inputs = json.dumps([[file['path'], file['size'], file['mtime']]
+                             for file in self.storage.list(pattern)])
+
+        if self.storage.read_text(marker) == inputs:
+            print(f'INFO: Bronze {name.lower()} parquet is up to date.')
+        elif self.dry_run:
+            return self._read(pattern, schema=schema)
+        else:
+            if self.config.getboolean('SMALL_FILES', 'ENABLED'):
+                pattern = self._merge_small_files(name, pattern)
+            self._write_bronze(self._read(pattern, schema=schema), bronze)
+            self.storage.write_text(marker, inputs)
+
+        return self.spark.read.parquet(bronze)
+
+    def _extract_incremental(self, name, schema):
+        """Reads only the JSON files that are not registered
+        in the watermark manifest, appends them to the bronze
+        Parquet files and reads back the new Parquet files.
+
+        The files are staged in the watermark, that is committed
+        after the load phase.
+
+        Args:
+            name: The FILES option prefix. E.g. LOGS or SONGS
+            schema: The JSON files schema.
+
+        Returns:
+            The DataFrame with the new data, that is empty
+            when there are no new files.
+        """
+        source = name.lower()
+        files = self.watermark.new_files(source, self.storage.list(self._input_pattern(name)))
+        self.watermark.register(source, files)
+        self.stats[f'{source}_files'] = len(files)
+        print(f'INFO: Found {len(files)} new {source} files.')
+
+        if not files:
+            return self.spark.createDataFrame([], schema)
+
+        data = self._read([file['path'] for file in files], schema=schema)
+        if self.dry_run:
+            return data
+        return self.spark.read.parquet(*self._write_bronze(data, self._bronze_path(name), mode='append'))
+
+    def _silver_path(self, table):
+        """Returns the silver parquet path of a table."""
+        return self.registry.tables[table].output_path(self.config)
+
+    def _dimensions(self, table):
+        """Reads the keys of the silver dimension tables referenced by a
+        table, that are checked by the orphans quality rule.
+
+        Args:
+            table: The table name. E.g. songplays
+
+        Returns:
+            A dictionary where each key is the reference column and the
+            value is the DataFrame of the dimension keys, without the
+            dimensions that were never written.
         """
-        return data.select(json_columns).toDF(*table_columns).drop_duplicates(duplicates)
+        dimensions = {}
+        for name, dimension in references.get(table, {}).items():
+            path = self._silver_path(dimension)
+            if self.storage.exists(path):
+                dimensions[name] = self.spark.read.parquet(path).select(name)
+        return dimensions
 
-    @staticmethod
-    def _transform_time(data, json_columns, table_columns, duplicates=None):
-        """Transforms the unix epoch timestamp into a unique time identifier
-        and add columns - hour, day, week, month, year and weekday - to the
-        table DataFrame.
+    def _song_dimension(self, song_data):
+        """Combines the new song data with the songs and artists
+        silver tables, so the new logs can be joined with all
+        songs processed by previous runs.
+
+        Args:
+            song_data: The DataFrame with the new songs data.
+
+        Returns:
+            The DataFrame with the song columns used by the songplays join.
+        """
+        songs_path = self._silver_path('songs')
+        artists_path = self._silver_path('artists')
+
+        if not (self.storage.exists(songs_path) and self.storage.exists(artists_path)):
+            return song_data
+
+        artists = self.spark.read.parquet(artists_path) \
+            .select('artist_id', col('name').alias('artist_name'))
+        existing = self.spark.read.parquet(songs_path).join(artists, 'artist_id')
+
+        return existing.select(lookup) \
+            .unionByName(song_data.select(lookup))
+
+    def _merge(self, tables):
+        """Removes the rows whose keys already exist in the silver
+        tables, so the remaining rows can be appended to them.
+
+        Args:
+            tables: A dictionary where each key is the name of the
+                table and the value is the corresponding DataFrame.
+
+        Returns:
+            A dictionary with the DataFrames of the new rows only.
+        """
+        merged = {}
+        for table, data in tables.items():
+            path = self._silver_path(table)
+            # the merge writer applies the updates of the tables with TABLE_<NAME>.MERGE
+            # and the gold rollups replace their partitions
+            if self.storage.exists(path) and not self.config.getboolean(f'TABLE_{table.upper()}', 'MERGE') \
+                    and self.registry.tables[table].layer != 'GOLD':
+                table_keys = self.registry.tables[table].keys
+                existing = self.spark.read.parquet(path).select(table_keys)
+                data = data.join(existing, table_keys, 'left_anti')
+            merged[table] = data
+        return merged
+
+    def _transform_table(self, data, json_columns, table_columns, duplicates=None, order_by=None):
+        """Renames all columns of a DataFrame and keeps one row
+        for each value of the given list of columns with duplicates.
 
         Args:
             data: The table DataFrame
             json_columns: Column names from spark infer schema.
             table_columns: Column names to write to the parquet file.
             duplicates: List of columns to drop duplicate values.
+            order_by: List of columns that pick the latest row of
+                each duplicate value, dropped after deduplication.
 
         Returns:
             The transformed table DataFrame.
         """
+        order_by = order_by or []
+        table = data.select(json_columns + order_by).toDF(*table_columns, *order_by)
+        return deduplicate(table, duplicates, order_by=order_by,
+                           salt_buckets=self.config.getint('DEDUP', 'SALT_BUCKETS')).drop(*order_by)
+
+    def _derive_time(self, log_data):
+        """Derives all timestamp columns of the log data in a single projection.
+
+        The unix epoch timestamp is transformed into a unique time
+        identifier, the start_time, and the hour, day, week, month,
+        year and weekday columns are extracted from it. The start_time
+        type depends on the TRANSFORM.BACKEND option.
+
+        Args:
+            log_data: The DataFrame with the filtered log data.
+
+        Returns:
+            The log data with the derived columns.
+        """
         # @formatter:off
-        time = data.select(json_columns) \
-            .withColumn('start_time', concat_ws('.',
-                                                from_unixtime((col('ts') / 1000), 'yyyy-MM-dd HH:mm:ss'),
-                                                substring(col('ts'), -3, 3))) \
+        return log_data \
+            .withColumn('start_time', start_time(self.config.get('TRANSFORM', 'BACKEND'))) \
             .withColumn('date', to_date('start_time')) \
-            .withColumn('hour', hour('date')) \
+            .withColumn('hour', hour('start_time')) \
             .withColumn('day', dayofmonth('date')) \
             .withColumn('week', weekofyear('date')) \
             .withColumn('month', month('date')) \
             .withColumn('year', year('date')) \
-            .withColumn('weekday', dayofweek('date')) \
-            .select(table_columns) \
-            .drop_duplicates(duplicates)
+            .withColumn('weekday', dayofweek('date'))
         # @formatter:on
-        return time
 
-    @staticmethod
-    def _transform_songplays(log_data, song_data, json_columns, table_columns):
-        """Join the log_data and song_data DataFrames and transforms
-        the unix epoch timestamp into a unique time identifier that
-        matches the time table.
+    def _enrich(self, log_data, consumers):
+        """Derives all timestamp columns of the log data and, when more
+        than one table reads it, persists and materializes the result,
+        so the tables that read the log data do not scan and transform
+        it again, even when they are written concurrently.
 
         Args:
-            log_data: The DataFrame with songplays data.
-            song_data: The DataFrame with songs data.
+            log_data: The DataFrame with the filtered log data.
+            consumers: The number of tables that read the log data.
+
+        Returns:
+            The log data with the derived columns.
+        """
+        enriched = self._derive_time(log_data)
+        if consumers < 2:
+            return enriched
+
+        storage_level = self.config.get('SPARK', 'STORAGE_LEVEL')
+        enriched = enriched.persist(getattr(StorageLevel, storage_level))
+        self.persisted.append(enriched)
+        self.stats['logs_storage_level'] = storage_level
+
+        # a dry run does not execute any job, otherwise the cache is
+        # filled before the consumers start, so each one reads it
+        if not self.dry_run:
+            self.stats['logs_rows'] = enriched.count()
+            self.stats['logs_scans_saved'] = consumers - 1
+        return enriched
+
+    def _transform_time(self, data, table_columns, duplicates=None):
+        """Selects the time columns derived by the enrichment stage
+        and drop duplicate values for the given list of columns.
+
+        Args:
+            data: The enriched log data DataFrame.
+            table_columns: Column names to write to the parquet file.
+            duplicates: List of columns to drop duplicate values.
+
+        The duplicated time rows are identical, so the map side partial
+        aggregation collapses them and the salted aggregation is not used.
+
+        Returns:
+            The transformed table DataFrame.
+        """
+        return deduplicate(data.select(table_columns), duplicates)
+
+    def _transform_songplays(self, log_data, lookup, json_columns, table_columns):
+        """Join the enriched log_data and the song lookup DataFrames and
+        reuses the unique time identifier derived by the enrichment
+        stage, that matches the time table.
+
+        The join uses the song lookup dimension keyed by the hash of
+        the song title, artist name and rounded duration, and the chosen
+        join strategy is recorded in the run statistics.
+
+        Args:
+            log_data: The enriched DataFrame with songplays data.
+            lookup: The song lookup DataFrame built by SongLookup.
             json_columns: Column names from spark infer schema.
             table_columns: Column names to write to the parquet file.
 
         Returns:
             The transformed table DataFrame.
         """
-        join_conditions = [
-            (col('sp.song') == col('so.title')) &
-            (col('sp.artist') == col('so.artist_name')) &
-            (col('sp.length') == col('so.duration'))
-        ]
         # @formatter:off
-        songplays = log_data.select(json_columns).alias('sp') \
-            .join(song_data.alias('so'), join_conditions) \
+        songplays = self.lookup.join(log_data.select(json_columns + ['start_time', 'month', 'year']), lookup,
+                                     bucketed=lookup is self.cached_lookup) \
             .withColumnRenamed('userAgent', 'user_agent') \
             .withColumnRenamed('sessionId', 'session_id') \
             .withColumnRenamed('userId', 'user_id') \
-            .withColumn('songplay_id', concat(col('user_id'),
-                                              col('session_id').cast('string'),
-                                              col('itemInSession').cast('string'))) \
-            .withColumn('start_time', concat_ws('.',
-                                                from_unixtime((col('ts') / 1000), 'yyyy-MM-dd HH:mm:ss'),
-                                                substring(col('ts'), -3, 3))) \
-            .withColumn('date', to_date('start_time')) \
-            .withColumn('month', month('date')) \
-            .withColumn('year', year('date')) \
+            .withColumn('songplay_id', songplay_id(self.config.get('TRANSFORM', 'BACKEND'))) \
             .select(table_columns)
         # @formatter:on
+        self.stats['songplays_join'] = self.lookup.strategy
         return songplays
 
-    def _transform(self, log_data, song_data):
-        """Calls the transformation function for each table.
+    def _touched_songplays(self, songplays):
+        """Adds the rows of the silver songplays table in the months
+        of the new songplays, so their rollups are computed again from
+        all rows of these months.
+
+        The months are a semi join, pruned by the dynamic partition
+        pruning of the silver scan. Outside a dry run, the silver rows
+        are persisted before the new rows are appended to the table.
+        The new rows that are already in the table, with the same
+        songplay_id, user and session, are dropped.
+
+        Args:
+            songplays: The DataFrame with the new songplays.
+
+        Returns:
+            The DataFrame with all songplays of the touched months.
+        """
+        path = self._silver_path('songplays')
+        if not self.storage.exists(path):
+            return songplays
+
+        months = songplays.select('year', 'month').distinct()
+        existing = self.spark.read.parquet(path).join(months, ['year', 'month'], 'left_semi') \
+            .select(songplays.columns)
+        if not self.dry_run:
+            existing = existing.persist(getattr(StorageLevel, self.config.get('SPARK', 'STORAGE_LEVEL')))
+            self.persisted.append(existing)
+            self.stats['rollup_existing_rows'] = existing.count()
+
+        # the string songplay_id is unique, the user and session also keep
+        # apart the rows of the native and arrow backends 64-bit hash ids
+        return existing.unionByName(songplays) \
+            .dropDuplicates([*self.registry.tables['songplays'].keys, 'user_id', 'session_id'])
+
+    def _transform_rollup(self, songplays, table_columns, condition, dimensions, measures):
+        """Aggregates the songplays into a gold rollup table.
+
+        The rollup is grouped by the year and month partitions and the
+        dimensions. In incremental mode only the months of the new
+        songplays are aggregated, from all their rows.
+
+        Args:
+            songplays: The songplays DataFrame of the transform phase.
+            table_columns: Column names to write to the parquet file.
+            condition: The optional SQL filter of the songplays rows.
+            dimensions: A dictionary of column names and SQL expressions.
+            measures: A dictionary of column names and SQL aggregate expressions.
+
+        Returns:
+            The transformed table DataFrame.
+        """
+        if self.incremental:
+            songplays = self._touched_songplays(songplays)
+        if condition:
+            songplays = songplays.where(condition)
+
+        return songplays \
+            .groupBy('year', 'month', *[expr(value).alias(name) for name, value in dimensions.items()]) \
+            .agg(*[expr(value).alias(name) for name, value in measures.items()]) \
+            .select(table_columns)
+
+    def _transform(self, log_data, song_data, song_dimension=None, definitions=None):
+        """Builds the sources read by the selected tables and calls
+        the transformation function of each table.
+
+        On a song dimension cache hit, the tables that read the song
+        data are skipped and the songplays join the cached lookup.
 
         Args:
             log_data: The DataFrame with songplays data.
-            song_data: The DataFrame with songs data.
+            song_data: The DataFrame with songs data, that is None
+                when the song lookup is read from the cache.
+            song_dimension: The DataFrame with songs data joined with
+                the songplays, defaults to song_data.
+            definitions: The list of TableDefinition objects to
+                transform, defaults to the selected tables.
 
         Returns:
             A dictionary where each key is the name of the
             table and the value is the corresponding DataFrame.
         """
-        print('INFO: Transform artists table.')
-        artists = self._transform_table(data=song_data,
-                                        json_columns=columns['artists']['json'],
-                                        table_columns=columns['artists']['table'],
-                                        duplicates=['artist_id'])
-
-        print('INFO: Transform songs table.')
-        songs = self._transform_table(data=song_data,
-                                      json_columns=columns['songs']['json'],
-                                      table_columns=columns['songs']['table'],
-                                      duplicates=['song_id'])
-
-        print('INFO: Transform users table.')
-        users = self._transform_table(data=log_data,
-                                      json_columns=columns['users']['json'],
-                                      table_columns=columns['users']['table'],
-                                      duplicates=['user_id'])
-
-        print('INFO: Transform time table.')
-        time = self._transform_time(data=log_data,
-                                    json_columns=columns['time']['json'],
-                                    table_columns=columns['time']['table'],
-                                    duplicates=['start_time'])
-
-        print('INFO: Transform songplays table.')
-        songplays = self._transform_songplays(log_data, song_data,
-                                              json_columns=columns['songplays']['json'],
-                                              table_columns=columns['songplays']['table'])
-
-        return {
-            'artists': artists,
-            'songs': songs,
-            'users': users,
-            'time': time,
-            'songplays': songplays
-        }
-
-    def _load(self, tables):
+        definitions = definitions or self.registry.resolve(self.selection)
+        if self.cached_lookup is not None:
+            definitions = [definition for definition in definitions if 'songs' not in definition.inputs]
+        required = self.registry.sources(definitions)
+        consumers = sum(1 for definition in definitions if 'logs' in definition.inputs)
+
+        self.stats['transform_backend'] = self.config.get('TRANSFORM', 'BACKEND')
+
+        inputs = {'songs': song_data}
+        if 'logs' in required:
+            print('INFO: Enrich log_data.')
+            inputs['logs'] = self._enrich(log_data, consumers=consumers)
+        if 'lookup' in required and self.cached_lookup is not None:
+            inputs['lookup'] = self.cached_lookup
+        elif 'lookup' in required:
+            inputs['lookup'] = self.lookup.build(song_dimension if song_dimension is not None else song_data)
+
+        tables = {}
+        storage_level = self.config.get('SPARK', 'STORAGE_LEVEL')
+        for definition in definitions:
+            print(f'INFO: Transform {definition.name} table.')
+            data = definition.transform(*[tables[name] if name in tables else inputs[name]
+                                          for name in definition.inputs])
+            # the tables read by other tables, e.g. the songplays of the rollups, are computed once
+            if any(definition.name in other.inputs for other in definitions):
+                data = data.persist(getattr(StorageLevel, storage_level))
+                self.persisted.append(data)
+            tables[definition.name] = data
+        return tables
+
+    def _write_table(self, table, data, mode):
+        """Writes a table DataFrame to its parquet silver path, with
+        the layout of its TABLE_<NAME> config section, and compacts
+        the small files when WRITE.COMPACT is set.
+
+        The table manifest, with the partition values, row count and
+        min and max statistics of each file, is written after the
+        files when WRITE.MANIFEST is set.
+
+        When the MERGE option of the table section is set, the rows
+        are upserted into the existing table by the merge writer,
+        that keeps the history of the changed rows if SCD2 is set.
+
+        The quality rules of the table, with the orphan rows checked
+        against the written dimension tables, are evaluated before the
+        write, so a failed check never replaces the existing table. The
+        table is persisted first, so the check and the write compute it
+        once, and the rule results are added to the load metrics record.
+
+        Args:
+            table: The table name.
+            data: The table DataFrame.
+            mode: The parquet write mode, overwrite or append.
+
+        Returns:
+            The write wall time in seconds.
+
+        Raises:
+            RuntimeError: If a quality rule breaches its fail threshold.
+        """
+        print(f'INFO: Write {table} parquet table.')
+        definition = self.registry.tables[table]
+        path = definition.output_path(self.config)
+        spec = definition.partition_spec(self.config)
+        section = f'TABLE_{table.upper()}'
+        # the gold rollups hold all rows of their partitions, that replace the existing ones
+        mode = 'overwrite' if definition.layer == 'GOLD' else mode
+
+        with self.metrics.stage('load', table) as record:
+            checked = self.quality.enabled and not data.is_cached
+            if checked:
+                data = data.persist(getattr(StorageLevel, self.config.get('SPARK', 'STORAGE_LEVEL')))
+            try:
+                record['quality'] = self.quality.check(table, data, self._dimensions(table))
+                if self.config.getboolean(section, 'MERGE'):
+                    record['merge'] = self.merger.merge(data, path, spec, definition.keys,
+                                                        scd2=self.config.getboolean(section, 'SCD2'))
+                else:
+                    self.writer.write(data, path, spec, mode)
+            finally:
+                if checked:
+                    data.unpersist()
+
+            if self.config.getboolean('WRITE', 'COMPACT'):
+                record['compacted_files'] = self.writer.compact(path, spec)
+
+            if self.config.getboolean('WRITE', 'MANIFEST'):
+                record['manifest_files'] = self.manifests.write(path, spec, statistics[table])
+
+        record['output_files'] = len(self.storage.list(spec.file_pattern(path)))
+
+        return record['wall_time']
+
+    def _write_table_in_pool(self, table, data, mode, pool):
+        """Writes a table DataFrame from a load thread, submitting its
+        Spark jobs to the given FAIR scheduler pool, as the threads do
+        not inherit the local properties of the thread that started
+        them. The previous pool of the thread is restored after the write.
+        """
+        context = self.spark.sparkContext
+        previous = context.getLocalProperty('spark.scheduler.pool')
+        context.setLocalProperty('spark.scheduler.pool', pool)
+        try:
+            return self._write_table(table, data, mode)
+        finally:
+            context.setLocalProperty('spark.scheduler.pool', previous)
+
+    def _load(self, tables, mode='overwrite'):
         """Writes the transformed DataFrames data to
         the corresponding parquet tables.
 
+        Each table is written as soon as the tables it reads, and the
+        dimension tables it references, were written. When LOAD.PARALLEL
+        is set, the ready tables are written concurrently by a bounded
+        thread pool, each one in the FAIR scheduler pool named after the
+        table, or <run pool>/<table> in a batch run, otherwise one at a
+        time in the pool of the calling thread.
+
         Args:
             tables: A dictionary where each key is the name of the
                 table and the value is the corresponding DataFrame.
+            mode: The parquet write mode, overwrite or append.
+
+        Raises:
+            RuntimeError: If any of the table writes failed.
         """
-        silver = self.config.get('S3', 'SILVER')
-
-        print(f'INFO: Write artists parquet table.')
-        tables['artists'].write.mode('overwrite') \
-            .option('partitionOverwriteMode', 'dynamic') \
-            .parquet(f"{silver}/{self.config.get('FILES', 'ARTISTS_SILVER')}")
-
-        print(f'INFO: Write songs parquet table.')
-        tables['songs'].write.mode('overwrite') \
-            .option('partitionOverwriteMode', 'dynamic') \
-            .partitionBy('year', 'artist_id') \
-            .parquet(f"{silver}/{self.config.get('FILES', 'SONGS_SILVER')}")
-
-        print(f'INFO: Write users parquet table.')
-        tables['users'].write.mode('overwrite') \
-            .option('partitionOverwriteMode', 'dynamic') \
-            .parquet(f"{silver}/{self.config.get('FILES', 'USERS_SILVER')}")
-
-        print(f'INFO: Write time parquet table.')
-        tables['time'].write.mode('overwrite') \
-            .option('partitionOverwriteMode', 'dynamic') \
-            .partitionBy('year', 'month') \
-            .parquet(f"{silver}/{self.config.get('FILES', 'TIME_SILVER')}")
-
-        print(f'INFO: Write songplays parquet table.')
-        tables['songplays'].write.mode('overwrite') \
-            .option('partitionOverwriteMode', 'dynamic') \
-            .partitionBy('year', 'month') \
-            .parquet(f"{silver}/{self.config.get('FILES', 'SONGPLAYS_SILVER')}")
+        parallel = self.config.getboolean('LOAD', 'PARALLEL')
+        # the orphans rule reads the dimension tables, so they are written first
+        dependencies = {table: [name for name in [*self.registry.dependencies(table),
+                                                  *references.get(table, {}).values()] if name in tables]
+                        for table in tables}
+        executor = DagExecutor(max_workers=self.config.getint('LOAD', 'MAX_WORKERS') if parallel else 1)
 
-    def start(self):
-        """Execute all pipeline phases and print time statistics."""
-        print('-----------------------------------------------------')
-        print('AWS EMR Spark ETL Pipeline')
-        print('-----------------------------------------------------')
+        # the pool of the calling thread, e.g. the pool of a batch run, is read before the load threads start
+        run_pool = self.spark.sparkContext.getLocalProperty('spark.scheduler.pool')
 
-        # PHASE 1: Extract
-        print('INFO: Extracting data.')
-        start = timer()
+        def pool(table):
+            if not parallel:
+                return run_pool
+            return f'{run_pool}/{table}' if run_pool else table
+
+        times = executor.run(dependencies,
+                             lambda table: self._write_table_in_pool(table, tables[table], mode, pool(table)))
+        for table, wall_time in times.items():
+            self.stats[f'{table}_write_time'] = round(wall_time, 2)
+
+    def _unpersist(self):
+        """Releases the DataFrames persisted by the transform phase."""
+        for data in self.persisted:
+            data.unpersist()
+        self.persisted = []
 
+    def _projection(self, source, definitions=None):
+        """Returns the columns of a source read by the given tables.
+
+        The columns are the union of the table metadata columns, so
+        the columns no table reads, e.g. the user names when only the
+        songplays run, are never read from the files nor persisted.
+
+        Args:
+            source: The source name. E.g. logs or songs
+            definitions: The list of TableDefinition objects, defaults
+                to the selected tables.
+
+        Returns:
+            The list of column names, in the source schema order.
+        """
+        names = set()
+        for definition in definitions or self.registry.resolve(self.selection):
+            if source in definition.inputs:
+                names.update(columns[definition.name]['json'] + ordering.get(definition.name, []))
+            # the song lookup is built from the song data
+            if source == 'songs' and 'lookup' in definition.inputs:
+                names.update(lookup)
+        return [field.name for field in schema[source].fields if field.name in names]
+
+    def _extract_logs(self):
+        """Extracts the log data, filters the NextSong events and
+        projects the columns read by the selected tables, that are
+        both pushed down to the bronze Parquet scan."""
         print('INFO: Extract log_data.')
-        if self.config.local:
-            source = self.config.get('FILES', 'LOGS_LANDING')
-            target = self.config.get('FILES', 'LOGS_BRONZE')
-            logs = self._extract(source=source, target=target,
-                                 schema=schema['logs'], multiline=True)
+        if self.incremental:
+            logs = self._extract_incremental('LOGS', schema=schema['logs'])
         else:
-            source = self.config.get('FILES', 'LOGS_BRONZE_S3')
-            logs = self._read(source=source, schema=schema['logs'])
+            logs = self._extract('LOGS', schema=schema['logs'])
 
-        # filter logs after repartition
-        logs = logs.where(col('page') == 'NextSong')
+        projection = self._projection('logs')
+        self.stats['logs_columns'] = len(projection)
+        return logs.where(col('page') == 'NextSong').select(projection)
 
+    def _extract_songs(self):
+        """Extracts the song data columns read by the selected tables.
+
+        When the song dimension cache has an entry for the song data
+        files and the songs and artists tables exist, the extraction
+        is skipped and the cached song lookup is used instead.
+
+        Returns:
+            The DataFrame with the song data, or None on a cache hit.
+        """
         print('INFO: Extract song_data.')
-        if self.config.local:
-            source = self.config.get('FILES', 'SONGS_LANDING')
-            target = self.config.get('FILES', 'SONGS_BRONZE')
-            songs = self._extract(source=source, target=target,
-                                  schema=schema['songs'], multiline=True)
-        else:
-            source = self.config.get('FILES', 'SONGS_BRONZE_S3')
-            songs = self._read(source=source, schema=schema['songs'])
+        projection = self._projection('songs')
+        self.stats['songs_columns'] = len(projection)
+        if self.incremental:
+            return self._extract_incremental('SONGS', schema=schema['songs']).select(projection)
 
-        extract_time = timer() - start
-        print('INFO: Extract phase finished.')
+        if self.cache is not None:
+            files = self.storage.list(self._input_pattern('SONGS'))
+            self.cache_key = self.cache.key(files, precision=self.lookup.precision, version=LOOKUP_VERSION)
+            tables_exist = all(self.storage.exists(self._silver_path(table)) for table in ('songs', 'artists'))
+            self.cached_lookup = self.cache.get(self.cache_key) if tables_exist else None
+            self.stats['song_cache'] = 'hit' if self.cached_lookup is not None else 'miss'
+
+            if self.cached_lookup is not None:
+                print('INFO: Song dimension cache hit, the songs and artists tables are up to date.')
+                return None
+
+        return self._extract('SONGS', schema=schema['songs']).select(projection)
+
+    def _cache_song_lookup(self, songs, tables):
+        """Saves the song lookup in the cache after the songs and
+        artists tables were written from the same song data."""
+        if self.cache is None or self.cached_lookup is not None or not {'songs', 'artists'} <= set(tables):
+            return
+
+        print('INFO: Save song dimension cache.')
+        with self.metrics.stage('load', 'song_cache'):
+            self.cache.put(self.cache_key, self.lookup.build(songs))
+
+    def _chunked(self, definition, chunked):
+        """Checks if a table is processed by chunks of the log data,
+        that is when it is partitioned by month and reads the logs or
+        the chunked tables, e.g. the songplays rollups.
+
+        Args:
+            definition: The TableDefinition object.
+            chunked: The names of the chunked tables it may read.
+        """
+        partition_by = definition.partition_spec(self.config).partition_by
+        reads_chunks = any(name == 'logs' or name in chunked for name in definition.inputs)
+        return reads_chunks and {'year', 'month'} <= set(partition_by)
+
+    def _process_chunks(self, logs, songs):
+        """Executes the transform and load phases of a full run with
+        bounded memory.
+
+        The tables partitioned by year and month are transformed and
+        written one month of log data at a time, after the other tables
+        are built from all data, so only one month of the log data is
+        persisted. Each chunk overwrites its own partitions only.
+
+        When the song dimension cache is enabled, the song lookup saved
+        after the first pass is joined by all chunks, otherwise it is
+        built again from the song data by each chunk.
+
+        Args:
+            logs: The DataFrame with the filtered log data.
+            songs: The DataFrame with the song data.
+        """
+        definitions = self.registry.resolve(self.selection)
+        chunked = []
+        # the definitions are in dependency order
+        for definition in definitions:
+            if self._chunked(definition, [table.name for table in chunked]):
+                chunked.append(definition)
+        others = [definition for definition in definitions if definition not in chunked]
+        # the same year and month of the start_time partition columns
+        month = from_unixtime(col('ts') / 1000, 'yyyy-MM')
+
+        with self.metrics.stage('transform', 'chunks'):
+            chunks = sorted(row[0] for row in logs.select(month).distinct().collect()) if chunked else []
+        self.stats['log_chunks'] = len(chunks)
+
+        passes = ([(None, others)] if others else []) + [(chunk, chunked) for chunk in chunks]
+        for chunk, chunk_definitions in passes:
+            print('-----------------------------------------------------')
+            print(f"INFO: Processing {'all log data' if chunk is None else f'the {chunk} log data'}.")
+
+            with self.metrics.stage('transform'):
+                tables = self._transform(log_data=logs if chunk is None else logs.where(month == chunk),
+                                         song_data=songs, definitions=chunk_definitions)
+            with self.metrics.stage('load'):
+                self._load(tables=tables, mode='overwrite')
+                if chunk is None:
+                    self._cache_song_lookup(songs, tables)
+            self._unpersist()
+
+            if chunk is None and self.cache is not None and self.cached_lookup is None:
+                self.cached_lookup = self.cache.get(self.cache_key)
+
+        print('INFO: Load phase finished.')
+
+    def _process(self, logs, songs):
+        """Executes the transform and load phases.
+
+        Args:
+            logs: The DataFrame with the filtered log data.
+            songs: The DataFrame with the song data.
+        """
+        if self.bounded and not self.incremental:
+            self._process_chunks(logs, songs)
+            return
 
         # PHASE 2: Transform
         print('-----------------------------------------------------')
         print('INFO: Transforming JSON data into tables.')
-        start = timer()
 
-        tables = self._transform(log_data=logs, song_data=songs)
+        with self.metrics.stage('transform'):
+            if self.incremental:
+                tables = self._transform(log_data=logs, song_data=songs,
+                                         song_dimension=self._song_dimension(songs))
+                tables = self._merge(tables)
+            else:
+                tables = self._transform(log_data=logs, song_data=songs)
 
-        transform_time = timer() - start
         print('INFO: Transform phase finished.')
 
         # PHASE 3: Load
         print('-----------------------------------------------------')
         print('INFO: Loading data into parquet tables.')
-        start = timer()
 
-        self._load(tables=tables)
+        with self.metrics.stage('load'):
+            self._load(tables=tables, mode='append' if self.incremental else 'overwrite')
 
-        load_time = timer() - start
+            if self.incremental and self.selection:
+                print('INFO: Watermark not committed, the next run processes the files for all tables.')
+            elif self.incremental:
+                self.watermark.commit()
+            else:
+                self._cache_song_lookup(songs, tables)
+
+        self._unpersist()
         print('INFO: Load phase finished.')
 
-        total_time = extract_time + transform_time + load_time
+    def start(self):
+        """Execute all pipeline phases, print time statistics
+        and save the metrics document.
+
+        Returns:
+            The path of the metrics document.
+        """
+        print('-----------------------------------------------------')
+        print('AWS EMR Spark ETL Pipeline')
+        print('-----------------------------------------------------')
+
+        # PHASE 1: Extract
+        print('INFO: Extracting data.')
+
+        with self.metrics.stage('extract'):
+            with self.metrics.stage('extract', 'logs'):
+                logs = self._extract_logs()
+            with self.metrics.stage('extract', 'songs'):
+                songs = self._extract_songs()
+
+        print('INFO: Extract phase finished.')
+
+        if self.incremental and not (self.stats['logs_files'] or self.stats['songs_files']):
+            print('INFO: No new input files, the silver tables are up to date.')
+        else:
+            self._process(logs, songs)
+
+        if self.bounded:
+            self.stats['peak_memory'] = peak_memory(self.spark)
+
         # STATS: print the time statistics
+        phases = ('extract', 'transform', 'load')
         print('-----------------------------------------------------')
         print('Time Statistics')
         print('-----------------------------------------------------')
-        print(f'Extract time: {round(extract_time, 2)} seconds')
-        print(f'Transform time: {round(transform_time, 2)} seconds')
-        print(f'Load time: {round(load_time, 2)} seconds')
-        print(f'Total time: {round(total_time, 2)} seconds')
+        for phase in phases:
+            print(f'{phase.capitalize()} time: {round(self.metrics.wall_time(phase), 2)} seconds')
+        print(f'Total time: {round(sum(self.metrics.wall_time(phase) for phase in phases), 2)} seconds')
+
+        if self.stats:
+            print('-----------------------------------------------------')
+            print('Run Statistics')
+            print('-----------------------------------------------------')
+            for key, value in self.stats.items():
+                print(f'{key}: {value}')
+
+        metrics_path = self.metrics.save(self.stats)
+        print('-----------------------------------------------------')
+        print(f'INFO: Metrics saved to {metrics_path}')
 
         print('-----------------------------------------------------')
         print('AWS EMR ETL Pipeline Success')
         print('-----------------------------------------------------')
+        return metrics_path
+
+    def explain(self):
+        """Builds the DataFrame of each table, as it is written, without
+        executing it, and saves the query plan report.
+
+        The bronze and silver files, the watermark manifest and the
+        song dimension cache are not changed, so the JSON input files
+        are read directly when the bronze files are not up to date.
+
+        Returns:
+            The paths of the JSON and text report files.
+        """
+        print('-----------------------------------------------------')
+        print('AWS EMR Spark ETL Pipeline Plan')
+        print('-----------------------------------------------------')
+
+        self.dry_run = True
+        self.cache = None
+        report = PlanReport(self.storage, self.config.get('S3', 'METRICS'))
+
+        logs, songs = self._extract_logs(), self._extract_songs()
+        if self.incremental:
+            tables = self._merge(self._transform(log_data=logs, song_data=songs,
+                                                 song_dimension=self._song_dimension(songs)))
+        else:
+            tables = self._transform(log_data=logs, song_data=songs)
+
+        for table, data in tables.items():
+            report.add(table, self.writer.layout(data, self.registry.tables[table].partition_spec(self.config)))
+        self._unpersist()
+
+        paths = report.save()
+        print(f"INFO: Query plan report saved to {' and '.join(paths)}")
+        return paths
 
     def stop(self):
-        """Stop the pipeline SparkContext."""
-        self.spark.stop()
+        """Stop the pipeline SparkContext, unless the session is shared."""
+        if not self.shared_session:
+            self.spark.stop()
@@ -0,0 +1,181 @@
+"""Defines the QualityCheck class to evaluate the data quality rules
+of each table in a single aggregation, before the table is written."""
+
+# sys libs
+from functools import reduce
+# spark libs
+from pyspark.sql.functions import col, count, countDistinct, lit, sum as sum_, when
+# metadata libs
+from etl.metadata import columns, keys
+
+RULES = ('null_keys', 'duplicate_keys', 'orphans', 'min_rows')
+"""The quality rules, each one with a WARN and a FAIL threshold in
+the QUALITY config section. The min_rows thresholds are row counts
+and the other thresholds are ratios of the table rows."""
+
+
+def _any_null(names):
+    """Returns a condition that is true when any of the columns is null."""
+    return reduce(lambda left, right: left | right, [col(name).isNull() for name in names])
+
+
+def _table_keys(table):
+    """Returns the key columns of a table."""
+    return [name for name in keys.get(table, []) if name in columns[table]['table']]
+
+
+def _found(name):
+    """Returns the name of the flag column of a matched reference."""
+    return f'_found_{name}'
+
+
+def rules(table, dimensions):
+    """Derives the quality metrics of a table from the etl.metadata
+    columns and keys of the table and, for the orphan rows, whose
+    references are not in the dimension tables, from the dimensions.
+
+    Args:
+        table: The table name. E.g. songplays
+        dimensions: A dictionary where each key is a reference column
+            and the value is the DataFrame of the dimension keys.
+
+    Returns:
+        A dictionary where each key is the metric name and the value
+        is the aggregate expression of the DataFrame returned by
+        with_dimensions.
+    """
+    table_keys = _table_keys(table)
+
+    metrics = {'rows': count(lit(1))}
+    if table_keys:
+        metrics['null_keys'] = sum_(when(_any_null(table_keys), 1).otherwise(0))
+        # the rows with a null key are not counted, like in the null_keys rule
+        metrics['distinct_keys'] = countDistinct(*[col(name) for name in table_keys])
+    if dimensions:
+        metrics['orphans'] = sum_(when(_any_null([_found(name) for name in dimensions]), 1).otherwise(0))
+    return metrics
+
+
+def with_dimensions(data, dimensions):
+    """Left joins the distinct keys of each dimension to the table, with
+    a flag column that is null when the reference is not found.
+
+    Args:
+        data: The table DataFrame.
+        dimensions: A dictionary where each key is a reference column
+            and the value is the DataFrame of the dimension keys.
+    """
+    for name, dimension in dimensions.items():
+        found = dimension.select(name).where(col(name).isNotNull()).distinct().withColumn(_found(name), lit(True))
+        data = data.join(found, name, 'left')
+    return data
+
+
+class QualityCheck:
+    """This class defines the data quality checks of the tables.
+
+    All metrics of a table, the exact distinct keys and the orphan
+    rows anti joined with the dimension tables included, are computed
+    by one aggregation. The rules are checked before the table is
+    written, so a failed check never replaces the existing table.
+
+    Usage example:
+
+    quality = QualityCheck.from_config(config)
+    quality.check('songs', songs)
+    songs.write.parquet(path)
+    """
+
+    def __init__(self, thresholds, enabled=True):
+        """Creates the QualityCheck object.
+
+        Args:
+            thresholds: A dictionary where each key is the rule name
+                and the value is the (warn, fail) thresholds tuple.
+            enabled: Defines if the tables are checked.
+        """
+        self.thresholds = thresholds
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates the QualityCheck object from the QUALITY config section."""
+        thresholds = {rule: (config.getfloat('QUALITY', f'{rule.upper()}_WARN'),
+                             config.getfloat('QUALITY', f'{rule.upper()}_FAIL'))
+                      for rule in RULES}
+        return cls(thresholds, enabled=config.getboolean('QUALITY', 'ENABLED'))
+
+    def measure(self, table, data, dimensions=None):
+        """Returns the quality metrics of a table, computed by a single aggregation.
+
+        Args:
+            table: The table name.
+            data: The table DataFrame.
+            dimensions: A dictionary where each key is a reference column
+                and the value is the DataFrame of the dimension keys.
+        """
+        dimensions = dimensions or {}
+        metrics = [expression.alias(name) for name, expression in rules(table, dimensions).items()]
+        return with_dimensions(data, dimensions).agg(*metrics).first().asDict()
+
+    def evaluate(self, metrics):
+        """Compares the quality metrics with the rule thresholds.
+
+        Args:
+            metrics: The dictionary of metrics returned by measure.
+
+        Returns:
+            A dictionary where each key is the rule name and the value
+            is a dictionary with the rule value and status, that is
+            pass, warn or fail.
+        """
+        rows = metrics['rows'] or 0
+        values = {'min_rows': rows}
+        if 'null_keys' in metrics:
+            values['null_keys'] = metrics['null_keys'] or 0
+            values['duplicate_keys'] = max(0, rows - values['null_keys'] - metrics['distinct_keys'])
+        if 'orphans' in metrics:
+            values['orphans'] = metrics['orphans'] or 0
+
+        results = {}
+        for rule, value in values.items():
+            if rule != 'min_rows':
+                value = round(value / rows, 6) if rows else 0.0
+
+            warn, fail = self.thresholds[rule]
+            if rule == 'min_rows':
+                status = 'fail' if value < fail else 'warn' if value < warn else 'pass'
+            else:
+                status = 'fail' if value > fail else 'warn' if value > warn else 'pass'
+            results[rule] = {'value': value, 'status': status}
+
+        return results
+
+    def check(self, table, data, dimensions=None):
+        """Measures and evaluates the quality rules of a table to be written.
+
+        Args:
+            table: The table name.
+            data: The table DataFrame.
+            dimensions: A dictionary where each key is a reference column
+                and the value is the DataFrame of the dimension keys.
+
+        Returns:
+            The rule results returned by evaluate, or None when
+            the checks are disabled.
+
+        Raises:
+            RuntimeError: If any rule breaches its fail threshold.
+        """
+        if not self.enabled:
+            return None
+
+        results = self.evaluate(self.measure(table, data, dimensions))
+        for rule, result in results.items():
+            if result['status'] == 'warn':
+                print(f"WARN: Quality rule {rule} of {table} table: {result['value']}")
+
+        failed = [rule for rule, result in results.items() if result['status'] == 'fail']
+        if failed:
+            raise RuntimeError(f"Quality rules failed for {table} table: {', '.join(failed)}")
+        return results
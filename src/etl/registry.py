@@ -0,0 +1,187 @@
+"""Defines the TableRegistry class to declare the silver tables and
+the DagExecutor class to run them in the order of their dependencies."""
+
+# sys libs
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+# writer libs
+from etl.writer import PartitionSpec
+
+
+class TableDefinition:
+    """This class defines how a table is built.
+
+    The inputs are the names of the pipeline sources, e.g. logs or
+    songs, or of other tables. The transform function receives the
+    input DataFrames in the same order and returns the table DataFrame.
+
+    Usage example:
+
+    TableDefinition('time', inputs=['logs'], transform=transform_time, keys=['start_time'])
+    """
+
+    def __init__(self, name, inputs, transform, keys=None, layer='SILVER'):
+        """Creates the TableDefinition object.
+
+        Args:
+            name: The table name. E.g. songplays
+            inputs: The list of source or table names.
+            transform: The function that returns the table DataFrame.
+            keys: The list of columns that identify a row.
+            layer: The data lake layer, SILVER or GOLD.
+        """
+        self.name = name
+        self.inputs = list(inputs)
+        self.transform = transform
+        self.keys = keys or []
+        self.layer = layer
+
+    def partition_spec(self, config):
+        """Returns the table PartitionSpec of the TABLE_<NAME> config section."""
+        return PartitionSpec.from_config(config, self.name)
+
+    def output_path(self, config):
+        """Returns the table parquet path in its layer."""
+        return f"{config.get('S3', self.layer)}/{config.get('FILES', f'{self.name.upper()}_{self.layer}')}"
+
+
+class TableRegistry:
+    """This class defines the registry of the pipeline tables.
+
+    Usage example:
+
+    registry = TableRegistry()
+    registry.register(TableDefinition('time', ['logs'], transform_time))
+    registry.resolve(['songplays'])
+    """
+
+    def __init__(self):
+        """Creates an empty TableRegistry object."""
+        self.tables = {}
+
+    def register(self, definition):
+        """Adds a table definition to the registry.
+
+        Args:
+            definition: The TableDefinition object.
+        """
+        self.tables[definition.name] = definition
+
+    def dependencies(self, name):
+        """Returns the names of the tables read by a table."""
+        return [source for source in self.tables[name].inputs if source in self.tables]
+
+    def resolve(self, selection=None):
+        """Returns the selected tables and the tables they read, in
+        dependency order and, otherwise, in registration order.
+
+        Args:
+            selection: The list of table names, defaults to all tables.
+
+        Raises:
+            ValueError: If a table is unknown or the dependencies have a cycle.
+        """
+        selection = selection or list(self.tables)
+        unknown = [name for name in selection if name not in self.tables]
+        if unknown:
+            raise ValueError(f"Unknown tables: {', '.join(unknown)}, the tables are {', '.join(self.tables)}")
+
+        ordered, visiting = [], set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError(f'The table {name} depends on itself')
+            visiting.add(name)
+            for dependency in self.dependencies(name):
+                visit(dependency)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in sorted(selection, key=list(self.tables).index):
+            visit(name)
+        return [self.tables[name] for name in ordered]
+
+    def sources(self, definitions):
+        """Returns the names of the sources, not tables, read by the given tables."""
+        return {source for definition in definitions for source in definition.inputs
+                if source not in self.tables}
+
+
+class DagExecutor:
+    """This class defines a bounded thread pool that runs each task as
+    soon as the tasks it depends on finished.
+
+    The failures are collected by task, the tasks that depend on a
+    failed task are skipped, and a RuntimeError is raised after all
+    tasks finish.
+
+    Usage example:
+
+    executor = DagExecutor(max_workers=5)
+    executor.run({'time': [], 'gold': ['time']}, write_table)
+    """
+
+    def __init__(self, max_workers):
+        """Creates the DagExecutor object.
+
+        Args:
+            max_workers: The max number of tasks running concurrently.
+        """
+        self.max_workers = max_workers
+
+    def run(self, dependencies, task):
+        """Runs the tasks in dependency order.
+
+        Args:
+            dependencies: A dictionary where each key is the task name
+                and the value is the list of task names it depends on.
+            task: The function called with each task name.
+
+        Returns:
+            A dictionary with the result of each task.
+
+        Raises:
+            ValueError: If a task depends on an unknown task or the
+                dependencies have a cycle, after the other tasks finish.
+            RuntimeError: If any of the tasks failed or was skipped.
+        """
+        results, failures, running = {}, {}, {}
+        pending = list(dependencies)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in list(pending):
+                    upstream = dependencies[name]
+                    if any(dependency in failures for dependency in upstream):
+                        print(f'ERROR: Skip {name}, an upstream task failed.')
+                        failures[name] = None
+                        pending.remove(name)
+                    elif all(dependency in results for dependency in upstream):
+                        running[executor.submit(task, name)] = name
+                        pending.remove(name)
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as error:  # pylint: disable=broad-except
+                        print(f'ERROR: Task {name} failed: {error}')
+                        failures[name] = error
+
+        # the tasks left are waiting for an unknown task or for each other
+        if pending:
+            unknown = sorted({dependency for name in pending for dependency in dependencies[name]
+                              if dependency not in dependencies})
+            detail = f"unknown tasks {', '.join(unknown)}" if unknown else 'a dependency cycle'
+            raise ValueError(f"Tasks never run: {', '.join(sorted(pending))}, waiting for {detail}")
+
+        if failures:
+            errors = [error for error in failures.values() if error is not None]
+            raise RuntimeError(f"Failed tasks: {', '.join(sorted(failures))}") \
+                from (errors[0] if errors else None)
+        return results
@@ -0,0 +1,24 @@
+"""Defines helper functions to estimate the size of Spark DataFrames."""
+
+
+def estimate_bytes(data):
+    """Returns the Spark optimizer size estimation of a DataFrame.
+
+    The estimation comes from the optimized logical plan statistics,
+    so no Spark job is executed. For file sources it is based on the
+    file sizes and the projected columns.
+
+    Args:
+        data: The DataFrame.
+
+    Returns:
+        The estimated size in bytes.
+    """
+    stats = data._jdf.queryExecution().optimizedPlan().stats()
+    # py4j converts the scala BigInt to a python int on recent versions
+    return int(str(stats.sizeInBytes()))
+
+
+def to_megabytes(size):
+    """Converts a size in bytes to megabytes rounded to two decimals."""
+    return round(size / (1024 * 1024), 2)
@@ -0,0 +1,166 @@
+"""Defines the SmallFileMerger class to merge the small JSON files of
+the landing zone into target sized files, like the AWS S3DistCp
+--groupBy option, in parallel and with a checkpoint manifest."""
+
+# sys libs
+import hashlib
+import posixpath
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+# data libs
+import json
+# spark libs
+from pyspark.sql.functions import col, trim
+
+
+class SmallFileMerger:
+    """This class defines the small files merge stage.
+
+    The input files are grouped by directory, e.g. the month of the
+    log_data files, and the files of each directory, sorted by path,
+    into batches of about the target size, so a new file changes the
+    batches of its directory only. Each batch is identified by the
+    hash of its files listing and merged by a Spark job into one JSON
+    lines file, so the data never goes through the driver. The ids of
+    the merged batches are saved in a checkpoint manifest after each
+    batch, so a failed run resumes without merging them again.
+
+    The input files must be JSON lines files, with one JSON object
+    by line, like the log_data and song_data files.
+
+    Usage example:
+
+    merger = SmallFileMerger(storage, target_size=128 * 1024 * 1024, max_workers=16)
+    merger.merge('data/landing/log_data/*/*/*.json', 'data/bronze/logs_merged')
+    """
+
+    CHECKPOINT = '_checkpoint.json'
+    """The checkpoint manifest file name, ignored by Spark readers."""
+
+    def __init__(self, storage, target_size, max_workers):
+        """Creates the SmallFileMerger object.
+
+        Args:
+            storage: The file system adapter.
+            target_size: The target merged file size in bytes.
+            max_workers: The number of batches merged in parallel.
+        """
+        self.storage = storage
+        self.target_size = target_size
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, storage, config):
+        """Creates the SmallFileMerger from the SMALL_FILES config section."""
+        return cls(storage,
+                   target_size=config.getint('SMALL_FILES', 'BATCH_SIZE_MB') * 1024 * 1024,
+                   max_workers=config.getint('SMALL_FILES', 'MAX_WORKERS'))
+
+    @staticmethod
+    def _batch_id(files):
+        """Returns the hash of the batch files listing."""
+        listing = json.dumps([[file['path'], file['size'], file['mtime']] for file in files])
+        return hashlib.sha1(listing.encode('utf-8')).hexdigest()[:16]
+
+    def plan(self, files):
+        """Groups the files into batches of about the target size.
+
+        Args:
+            files: A list of files returned by Storage.list.
+
+        Returns:
+            A dictionary where each key is the batch id and
+            the value is the list of files of the batch.
+        """
+        directories = {}
+        for file in sorted(files, key=lambda item: item['path']):
+            directories.setdefault(posixpath.dirname(file['path']), []).append(file)
+
+        batches = {}
+        for directory in sorted(directories):
+            batch, size = [], 0
+            for file in directories[directory]:
+                batch.append(file)
+                size += file['size']
+                if size >= self.target_size:
+                    batches[self._batch_id(batch)] = batch
+                    batch, size = [], 0
+
+            if batch:
+                batches[self._batch_id(batch)] = batch
+        return batches
+
+    def _merge_batch(self, batch_id, files, target):
+        """Concatenates the files of a batch into one JSON lines file.
+
+        The lines are written by one task into a temporary folder,
+        ignored by Spark readers, and its part file is renamed to the
+        batch file.
+        """
+        staging = f'{target}/_tmp-{batch_id}-{uuid.uuid4().hex[:8]}'
+        lines = self.storage.spark.read.text([file['path'] for file in files])
+        lines.where(trim(col('value')) != '').coalesce(1).write.mode('overwrite').text(staging)
+
+        try:
+            parts = self.storage.list(f'{staging}/part-*')
+            if len(parts) != 1:
+                raise IOError(f'Expected one part file in {staging}, found {len(parts)}')
+            self.storage.rename(parts[0]['path'], f'{target}/batch-{batch_id}.json')
+        finally:
+            self.storage.delete(staging)
+
+    def _save_checkpoint(self, checkpoint, path):
+        """Persists the checkpoint manifest, one thread at a time."""
+        with self.lock:
+            self.storage.write_text(path, json.dumps(checkpoint, indent=2))
+
+    def merge(self, pattern, target):
+        """Merges the files matching the pattern into the target folder.
+
+        The merged files of batches that are no longer in the plan,
+        because their input files changed, are deleted.
+
+        Args:
+            pattern: The glob pattern of the input files.
+            target: The folder of the merged files.
+
+        Returns:
+            A dictionary with the number of batches planned, merged
+            in this run and reused from the checkpoint.
+        """
+        checkpoint_path = f'{target}/{self.CHECKPOINT}'
+        checkpoint = json.loads(self.storage.read_text(checkpoint_path) or '{"batches": {}}')
+        batches = self.plan(self.storage.list(pattern))
+
+        for batch_id in set(checkpoint['batches']) - set(batches):
+            self.storage.delete(f'{target}/batch-{batch_id}.json')
+            del checkpoint['batches'][batch_id]
+
+        pending = {batch_id: files for batch_id, files in batches.items()
+                   if batch_id not in checkpoint['batches']}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._merge_batch, batch_id, files, target): batch_id
+                       for batch_id, files in pending.items()}
+
+            failures = []
+            for future in as_completed(futures):
+                batch_id = futures[future]
+                try:
+                    future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    print(f'ERROR: Merge batch {batch_id} failed: {error}')
+                    failures.append(error)
+                    continue
+
+                checkpoint['batches'][batch_id] = len(batches[batch_id])
+                self._save_checkpoint(checkpoint, checkpoint_path)
+
+        self._save_checkpoint(checkpoint, checkpoint_path)
+
+        if failures:
+            raise RuntimeError(f'Failed to merge {len(failures)} of {len(pending)} batches') from failures[0]
+
+        return {'batches': len(batches), 'merged': len(pending), 'reused': len(batches) - len(pending)}
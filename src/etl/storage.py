@@ -0,0 +1,182 @@
+"""Defines a Storage class to list, read and write files on the local
+file system or on any Hadoop compatible file system, like AWS S3."""
+
+# sys libs
+import glob
+import os
+import shutil
+from urllib.parse import urlparse
+
+
+def _expand_braces(pattern):
+    """Expands the {a,b} alternatives of a glob pattern, as the Hadoop
+    glob does, into the list of patterns of the python glob module."""
+    start = pattern.find('{')
+    if start < 0:
+        return [pattern]
+
+    depth = 0
+    for end in range(start, len(pattern)):
+        depth += {'{': 1, '}': -1}.get(pattern[end], 0)
+        if depth == 0:
+            break
+    else:
+        return [pattern]
+
+    alternatives, depth, begin = [], 0, start + 1
+    for index in range(start + 1, end):
+        depth += {'{': 1, '}': -1}.get(pattern[index], 0)
+        if pattern[index] == ',' and depth == 0:
+            alternatives.append(pattern[begin:index])
+            begin = index + 1
+    alternatives.append(pattern[begin:end])
+
+    return [expanded for alternative in alternatives
+            for expanded in _expand_braces(pattern[:start] + alternative + pattern[end + 1:])]
+
+
+class Storage:
+    """This class defines a small file system adapter.
+
+    Local paths are handled by the python standard library, so
+    they can be used before the Spark session is created. Remote
+    paths (s3://, hdfs://) are handled by the Hadoop FileSystem
+    of the Spark session JVM.
+
+    Usage example:
+
+    storage = Storage(spark)
+    files = storage.list('s3://bucket/log_data/*/*/*.json')
+    """
+
+    def __init__(self, spark=None):
+        """Creates the Storage object.
+
+        Args:
+            spark: The Spark session, required for remote paths only.
+        """
+        self.spark = spark
+
+    @staticmethod
+    def is_local(path):
+        """Checks if the path belongs to the local file system."""
+        return urlparse(path).scheme in ('', 'file')
+
+    @staticmethod
+    def _local_path(path):
+        """Removes the file:// scheme from a local path."""
+        return urlparse(path).path if path.startswith('file:') else path
+
+    def _hadoop_path(self, path):
+        """Returns the Hadoop Path and FileSystem objects for a path."""
+        if self.spark is None:
+            raise ValueError(f'A Spark session is required to access: {path}')
+
+        jvm = self.spark.sparkContext._jvm
+        conf = self.spark.sparkContext._jsc.hadoopConfiguration()
+        hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+        return hadoop_path, hadoop_path.getFileSystem(conf)
+
+    def list(self, pattern):
+        """Lists all files matching a glob pattern.
+
+        Args:
+            pattern: The glob pattern. E.g. log_data/*/*/*.json
+                or log_data/2018/11/{2018-11-01,2018-11-02}-events.json
+
+        Returns:
+            A list of dictionaries, sorted by path, with the file
+            path, size in bytes and modification time in milliseconds.
+        """
+        if self.is_local(pattern):
+            files = []
+            paths = {path for expanded in _expand_braces(self._local_path(pattern)) for path in glob.glob(expanded)}
+            for path in paths:
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    files.append({'path': os.path.normpath(path),
+                                  'size': stat.st_size,
+                                  'mtime': int(stat.st_mtime * 1000)})
+            return sorted(files, key=lambda file: file['path'])
+
+        hadoop_path, fs = self._hadoop_path(pattern)
+        statuses = fs.globStatus(hadoop_path) or []
+        files = [{'path': status.getPath().toString(),
+                  'size': status.getLen(),
+                  'mtime': status.getModificationTime()}
+                 for status in statuses if status.isFile()]
+        return sorted(files, key=lambda file: file['path'])
+
+    def exists(self, path):
+        """Checks if a file or directory exists."""
+        if self.is_local(path):
+            return os.path.exists(self._local_path(path))
+
+        hadoop_path, fs = self._hadoop_path(path)
+        return fs.exists(hadoop_path)
+
+    def read_text(self, path):
+        """Reads an UTF-8 text file.
+
+        Returns:
+            The file content or None if the file does not exist.
+        """
+        if not self.exists(path):
+            return None
+
+        if self.is_local(path):
+            with open(self._local_path(path), encoding='utf-8') as file:
+                return file.read()
+
+        hadoop_path, fs = self._hadoop_path(path)
+        stream = fs.open(hadoop_path)
+        try:
+            jvm = self.spark.sparkContext._jvm
+            return jvm.org.apache.commons.io.IOUtils.toString(stream, 'UTF-8')
+        finally:
+            stream.close()
+
+    def write_text(self, path, text):
+        """Writes an UTF-8 text file, replacing the existing one."""
+        if self.is_local(path):
+            local_path = self._local_path(path)
+            os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+            # write to a temp file first so readers never see a partial file
+            with open(f'{local_path}.tmp', 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(f'{local_path}.tmp', local_path)
+            return
+
+        hadoop_path, fs = self._hadoop_path(path)
+        stream = fs.create(hadoop_path, True)
+        try:
+            stream.write(bytearray(text.encode('utf-8')))
+        finally:
+            stream.close()
+
+    def delete(self, path):
+        """Deletes a file or a directory recursively."""
+        if self.is_local(path):
+            local_path = self._local_path(path)
+            if os.path.isdir(local_path):
+                shutil.rmtree(local_path)
+            elif os.path.exists(local_path):
+                os.remove(local_path)
+            return
+
+        hadoop_path, fs = self._hadoop_path(path)
+        fs.delete(hadoop_path, True)
+
+    def rename(self, source, target):
+        """Moves a file or directory to the target path."""
+        if self.is_local(source):
+            local_target = self._local_path(target)
+            os.makedirs(os.path.dirname(local_target) or '.', exist_ok=True)
+            os.replace(self._local_path(source), local_target)
+            return
+
+        source_path, fs = self._hadoop_path(source)
+        target_path, _ = self._hadoop_path(target)
+        fs.mkdirs(target_path.getParent())
+        if not fs.rename(source_path, target_path):
+            raise IOError(f'Could not rename {source} to {target}')
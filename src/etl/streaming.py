@@ -0,0 +1,153 @@
+"""Defines the StreamingPipeline class to ingest the log_data JSON
+files with Spark Structured Streaming and append each micro-batch
+to the songplays and time parquet tables."""
+
+# spark libs
+from pyspark import StorageLevel
+from pyspark.sql.functions import col
+# metadata libs
+from etl.metadata import columns, schema
+# pipeline libs
+from etl.pipeline import ETLPipeline
+
+
+class StreamingPipeline(ETLPipeline):
+    """This class defines the log_data streaming ingestion.
+
+    The log_data JSON files of the landing path are read by a file
+    source, that records the processed files in the checkpoint
+    directory. Each micro-batch is joined with the song lookup,
+    built once from the songs and artists silver tables and cached,
+    and the new songplays and time rows are appended to the tables.
+
+    The rows whose keys already exist in the tables are removed
+    before the append, so a micro-batch replayed after a failure
+    does not duplicate them.
+
+    Usage example:
+
+    config = Config(local=True)
+    pipeline = StreamingPipeline(config)
+    pipeline.start()
+    pipeline.stop()
+    """
+
+    def __init__(self, config):
+        """Creates the StreamingPipeline object and sets the config object.
+
+        Args:
+            config: The config adapter wrapper.
+        """
+        super().__init__(config)
+        self.song_lookup = None
+
+    def _build_song_lookup(self):
+        """Builds and caches the song lookup from the songs and artists
+        silver tables or, before the first batch run, from the song data.
+
+        Returns:
+            The persisted song lookup DataFrame.
+        """
+        if self.storage.exists(self._silver_path('songs')) and self.storage.exists(self._silver_path('artists')):
+            dimension = self._song_dimension(self.spark.createDataFrame([], schema['songs']))
+        else:
+            dimension = self._extract('SONGS', schema=schema['songs'])
+
+        storage_level = self.config.get('SPARK', 'STORAGE_LEVEL')
+        lookup = self.lookup.build(dimension).persist(getattr(StorageLevel, storage_level))
+        self.persisted.append(lookup)
+        self.stats['song_keys'] = lookup.count()
+        return lookup
+
+    def _read_stream(self):
+        """Reads the new log_data JSON files of the landing path,
+        filters the NextSong events and parses only the columns read
+        by the songplays and time tables.
+
+        Returns:
+            The streaming DataFrame with the filtered log data.
+        """
+        pattern = f"{self.config.get('S3', 'LANDING')}/{self.config.get('FILES', 'LOGS_LANDING')}"
+
+        return self.spark.readStream \
+            .schema(schema['logs']) \
+            .option('maxFilesPerTrigger', self.config.getint('STREAMING', 'MAX_FILES_PER_TRIGGER')) \
+            .json(pattern) \
+            .where(col('page') == 'NextSong') \
+            .select(self._projection('logs', [self.registry.tables['time'], self.registry.tables['songplays']]))
+
+    def _process_batch(self, batch, batch_id):
+        """Transforms a micro-batch and appends it to the songplays
+        and time tables.
+
+        Args:
+            batch: The DataFrame with the micro-batch log data.
+            batch_id: The micro-batch identifier.
+        """
+        print(f'INFO: Process micro-batch {batch_id}.')
+        storage_level = self.config.get('SPARK', 'STORAGE_LEVEL')
+        log_data = self._derive_time(batch).persist(getattr(StorageLevel, storage_level))
+
+        try:
+            with self.metrics.stage('stream', f'batch-{batch_id}'):
+                time = self._transform_time(data=log_data,
+                                            table_columns=columns['time']['table'],
+                                            duplicates=['start_time'])
+                songplays = self._transform_songplays(log_data, self.song_lookup,
+                                                      json_columns=columns['songplays']['json'],
+                                                      table_columns=columns['songplays']['table'])
+
+                for table, data in self._merge({'time': time, 'songplays': songplays}).items():
+                    self._write_table(table, data, mode='append')
+        finally:
+            log_data.unpersist()
+
+    def start(self):
+        """Builds the song lookup, runs the streaming query until it
+        terminates and saves the metrics document.
+
+        With STREAMING.TRIGGER=once the query processes the files that
+        arrived since the last run and stops, otherwise it runs a
+        micro-batch on each processing time interval, e.g. 5 minutes.
+        """
+        print('-----------------------------------------------------')
+        print('AWS EMR Spark Streaming Pipeline')
+        print('-----------------------------------------------------')
+
+        print('INFO: Build song lookup.')
+        with self.metrics.stage('extract', 'songs'):
+            self.song_lookup = self._build_song_lookup()
+
+        trigger = self.config.get('STREAMING', 'TRIGGER')
+        checkpoint = f"{self.config.get('S3', 'CHECKPOINT')}/{self.config.get('FILES', 'LOGS_CHECKPOINT')}"
+        print(f'INFO: Stream log_data with trigger {trigger}.')
+
+        writer = self._read_stream().writeStream \
+            .foreachBatch(self._process_batch) \
+            .option('checkpointLocation', checkpoint)
+        if trigger.lower() == 'once':
+            writer = writer.trigger(once=True)
+        else:
+            writer = writer.trigger(processingTime=trigger)
+
+        query = writer.start()
+        try:
+            query.awaitTermination()
+        finally:
+            progress = query.recentProgress
+            self.stats['stream_batches'] = len(progress)
+            self.stats['stream_rows'] = sum(batch['numInputRows'] for batch in progress)
+            self._unpersist()
+
+        print('-----------------------------------------------------')
+        print('Run Statistics')
+        print('-----------------------------------------------------')
+        for key, value in self.stats.items():
+            print(f'{key}: {value}')
+
+        print('-----------------------------------------------------')
+        print(f'INFO: Metrics saved to {self.metrics.save(self.stats)}')
+
+        print('-----------------------------------------------------')
+        print('AWS EMR Streaming Pipeline Success')
+        print('-----------------------------------------------------')
@@ -0,0 +1,109 @@
+"""Defines the TuningProfile class to pick the Spark session settings
+according to the volume of the input data."""
+
+SETTINGS = {
+    'SHUFFLE_PARTITIONS': ('getint', lambda value: {'spark.sql.shuffle.partitions': str(value)}),
+    'ADAPTIVE': ('getboolean', lambda value: {'spark.sql.adaptive.enabled': str(value).lower(),
+                                              'spark.sql.adaptive.coalescePartitions.enabled': str(value).lower()}),
+    'BROADCAST_THRESHOLD_MB': ('getint', lambda value: {'spark.sql.autoBroadcastJoinThreshold':
+                                                        str(value * 1024 * 1024)}),
+    'PARQUET_CODEC': ('get', lambda value: {'spark.sql.parquet.compression.codec': value}),
+    'KRYO': ('getboolean', lambda value: {'spark.serializer': 'org.apache.spark.serializer.KryoSerializer'
+                                          if value else 'org.apache.spark.serializer.JavaSerializer'})
+}
+"""Maps the profile options to the Config getter of their type and
+to the Spark settings of the parsed value."""
+
+STATIC_SETTINGS = ('spark.serializer',)
+"""The Spark settings that can only be set before the session starts."""
+
+PROFILE_PREFIX = 'PROFILE_'
+"""The prefix of the profile sections in the etl.cfg file."""
+
+
+def estimate_input(storage, patterns):
+    """Sums the size of all files matching the glob patterns.
+
+    Args:
+        storage: The file system adapter.
+        patterns: The list of glob patterns of the input files.
+
+    Returns:
+        The input size in bytes.
+    """
+    return sum(file['size'] for pattern in patterns for file in storage.list(pattern))
+
+
+class TuningProfile:
+    """This class defines a set of Spark session settings.
+
+    The profiles are the PROFILE_<NAME> sections of the etl.cfg file,
+    e.g. PROFILE_LOCAL_SMALL, PROFILE_CLUSTER_MEDIUM and
+    PROFILE_CLUSTER_LARGE, and new ones can be added to it. With
+    SPARK.PROFILE=auto, the profile with the smallest MAX_INPUT_MB
+    greater than the input size is selected.
+
+    Usage example:
+
+    profile = TuningProfile.select(config, input_size=5 * 1024 * 1024)
+    builder = profile.configure(SparkSession.builder)
+    """
+
+    def __init__(self, name, settings):
+        """Creates the TuningProfile object.
+
+        Args:
+            name: The profile name. E.g. LOCAL_SMALL
+            settings: A dictionary of Spark settings.
+        """
+        self.name = name
+        self.settings = settings
+
+    @classmethod
+    def from_config(cls, config, name):
+        """Creates the TuningProfile from its PROFILE_<NAME> config section."""
+        section = f'{PROFILE_PREFIX}{name.upper()}'
+        settings = {}
+        for option, (getter, to_settings) in SETTINGS.items():
+            settings.update(to_settings(getattr(config, getter)(section, option)))
+        return cls(name.upper(), settings)
+
+    @classmethod
+    def select(cls, config, input_size):
+        """Selects the profile of SPARK.PROFILE or, when it is auto,
+        the smallest profile that fits the input size.
+
+        Args:
+            config: The config adapter wrapper.
+            input_size: The input size in bytes.
+        """
+        name = config.get('SPARK', 'PROFILE')
+        if name.lower() != 'auto':
+            return cls.from_config(config, name)
+
+        profiles = sorted((config.getint(section, 'MAX_INPUT_MB'), section[len(PROFILE_PREFIX):])
+                          for section in config.sections(PROFILE_PREFIX))
+        for max_input, name in profiles:
+            if input_size <= max_input * 1024 * 1024:
+                return cls.from_config(config, name)
+        return cls.from_config(config, profiles[-1][1])
+
+    def configure(self, builder):
+        """Adds all profile settings to a SparkSession builder."""
+        for key, value in self.settings.items():
+            builder = builder.config(key, value)
+        return builder
+
+    def apply(self, spark):
+        """Sets the runtime profile settings of a running session.
+
+        Returns:
+            The list of static settings that were not applied.
+        """
+        skipped = []
+        for key, value in self.settings.items():
+            if key in STATIC_SETTINGS:
+                skipped.append(key)
+            else:
+                spark.conf.set(key, value)
+        return skipped
@@ -0,0 +1,198 @@
+"""Defines the TableWriter class to write the silver Parquet tables
+with files close to a target size and to compact small files."""
+
+# sys libs
+import math
+import os
+import uuid
+# spark libs
+from pyspark.sql.functions import col
+# sizing libs
+from etl.sizing import estimate_bytes
+
+
+class PartitionSpec:
+    """This class defines the Parquet layout of a table.
+
+    The rows are written into one directory per value of the
+    partition columns. Inside each directory, the rows can be
+    clustered into a fixed number of files, the buckets, by the
+    hash of a high cardinality column, like artist_id, instead of
+    creating one directory per value of that column.
+
+    Usage example:
+
+    spec = PartitionSpec.from_config(config, 'songs')
+    """
+
+    def __init__(self, partition_by=None, bucket_by=None, buckets=0):
+        """Creates the PartitionSpec object.
+
+        Args:
+            partition_by: The list of partition columns.
+            bucket_by: The column used to cluster the rows into buckets.
+            buckets: The number of buckets by partition directory.
+        """
+        self.partition_by = partition_by or []
+        self.bucket_by = bucket_by
+        self.buckets = buckets if bucket_by else 0
+
+    @classmethod
+    def from_config(cls, config, table):
+        """Creates the PartitionSpec from the TABLE_<NAME> config section.
+
+        Args:
+            config: The config adapter wrapper.
+            table: The table name. E.g. songs
+        """
+        section = f'TABLE_{table.upper()}'
+
+        return cls(partition_by=config.getlist(section, 'PARTITION_BY'),
+                   bucket_by=config.get(section, 'BUCKET_BY') or None,
+                   buckets=config.getint(section, 'BUCKETS'))
+
+    def file_pattern(self, path):
+        """Returns the glob pattern of the Parquet files of a table.
+
+        Args:
+            path: The table path.
+        """
+        return path + '/*' * len(self.partition_by) + '/*.parquet'
+
+
+class TableWriter:
+    """This class defines a target file size aware Parquet writer.
+
+    The table DataFrame is repartitioned by its partition columns, so
+    each partition directory is written by a single task. A bucketed
+    table is repartitioned into its number of buckets instead, so each
+    task writes the rows of one bucket and each partition directory
+    gets at most one file by bucket. The max records by file is the
+    target file size divided by the estimated row size.
+
+    Usage example:
+
+    writer = TableWriter.from_config(spark, storage, config)
+    writer.write(songs, path, PartitionSpec(['year'], 'artist_id', 8))
+    writer.compact(path, spec)
+    """
+
+    def __init__(self, spark, storage, target_file_size, compact_min_files):
+        """Creates the TableWriter object.
+
+        Args:
+            spark: The Spark session.
+            storage: The file system adapter.
+            target_file_size: The target Parquet file size in bytes.
+            compact_min_files: The min number of small files in a
+                partition directory to compact them.
+        """
+        self.spark = spark
+        self.storage = storage
+        self.target_file_size = target_file_size
+        self.compact_min_files = compact_min_files
+
+    @classmethod
+    def from_config(cls, spark, storage, config):
+        """Creates the TableWriter object from the WRITE config section."""
+        return cls(spark, storage,
+                   target_file_size=config.getint('WRITE', 'TARGET_FILE_SIZE_MB') * 1024 * 1024,
+                   compact_min_files=config.getint('WRITE', 'COMPACT_MIN_FILES'))
+
+    def _records_per_file(self, data):
+        """Estimates the number of rows that fill a target size file."""
+        row_size = max(1, data._jdf.schema().defaultSize())
+        return max(1, self.target_file_size // row_size)
+
+    def layout(self, data, spec):
+        """Repartitions and sorts the table DataFrame as it is written.
+
+        Args:
+            data: The table DataFrame.
+            spec: The table PartitionSpec.
+
+        Returns:
+            The DataFrame with one partition by file group.
+        """
+        if spec.buckets:
+            # one task by bucket, that writes one file in each partition directory
+            data = data.repartition(spec.buckets, col(spec.bucket_by))
+        elif spec.partition_by:
+            data = data.repartition(*[col(name) for name in spec.partition_by])
+        else:
+            files = math.ceil(estimate_bytes(data) / self.target_file_size)
+            # the estimate is Long.MaxValue when the plan has no statistics, e.g. an RDD
+            # source, so the partitions are kept and the max records by file apply
+            if files <= int(self.spark.conf.get('spark.sql.shuffle.partitions')):
+                data = data.repartition(max(1, files))
+
+        if spec.bucket_by:
+            data = data.sortWithinPartitions(spec.bucket_by)
+        return data
+
+    def write(self, data, path, spec, mode='overwrite'):
+        """Writes the table DataFrame as Parquet files.
+
+        Args:
+            data: The table DataFrame.
+            path: The table path.
+            spec: The table PartitionSpec.
+            mode: The parquet write mode, overwrite or append.
+        """
+        data = self.layout(data, spec)
+        writer = data.write.mode(mode) \
+            .option('partitionOverwriteMode', 'dynamic') \
+            .option('maxRecordsPerFile', self._records_per_file(data))
+        if spec.partition_by:
+            writer = writer.partitionBy(*spec.partition_by)
+        writer.parquet(path)
+
+    def compact(self, path, spec):
+        """Merges the small Parquet files of each partition directory.
+
+        A file is small when it has less than half of the target file
+        size. The merged files are written to a staging folder, moved
+        into the partition directory and only then the small files are
+        deleted, so a failure never loses data.
+
+        Args:
+            path: The table path.
+            spec: The table PartitionSpec.
+
+        Returns:
+            The number of small files that were merged.
+        """
+        directories = {}
+        for file in self.storage.list(spec.file_pattern(path)):
+            if file['size'] < self.target_file_size // 2:
+                directories.setdefault(os.path.dirname(file['path']), []).append(file)
+
+        compacted = 0
+        for directory, files in directories.items():
+            if len(files) < self.compact_min_files:
+                continue
+
+            staging = f'{directory}/_compaction'
+            num_files = max(1, math.ceil(sum(file['size'] for file in files) / self.target_file_size))
+            data = self.spark.read.parquet(*[file['path'] for file in files])
+            # partition values are stored in the directory names, not in the files
+            data = data.drop(*[name for name in spec.partition_by if name in data.columns])
+            if spec.buckets:
+                # the same hash modulo BUCKETS as the write, so each file still holds one bucket
+                data = data.repartition(spec.buckets, col(spec.bucket_by)).sortWithinPartitions(spec.bucket_by)
+            elif spec.bucket_by:
+                data = data.repartition(num_files, spec.bucket_by).sortWithinPartitions(spec.bucket_by)
+            else:
+                data = data.coalesce(num_files)
+            data.write.mode('overwrite').parquet(staging)
+
+            for staged in self.storage.list(f'{staging}/*.parquet'):
+                name = f'part-compacted-{uuid.uuid4().hex}.parquet'
+                self.storage.rename(staged['path'], f'{directory}/{name}')
+            for file in files:
+                self.storage.delete(file['path'])
+            self.storage.delete(staging)
+
+            compacted += len(files)
+
+        return compacted
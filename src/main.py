@@ -6,18 +6,23 @@ from etl.config import Config
 from etl.pipeline import ETLPipeline
 
 
-def run(local):
+def run(local, overrides=None):
     """The main.py script entry point to run the ETLPipeline.
 
     Args:
         local: If True uses the AWS EMR and S3 configurations,
             otherwise uses the local file system and the localhost
             Spark session.
+        overrides: A dictionary of SECTION.OPTION keys and values
+            that override the etl.cfg options.
     """
     # sets the session host
-    config = Config(local=local)
+    config = Config(local=local, overrides=overrides)
 
-    # run the pipeline
+    # run the pipeline or only report the query plans
     pipeline = ETLPipeline(config)
-    pipeline.start()
+    if config.getboolean('PIPELINE', 'EXPLAIN'):
+        pipeline.explain()
+    else:
+        pipeline.start()
     pipeline.stop()
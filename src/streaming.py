@@ -0,0 +1,25 @@
+"""Defines the StreamingPipeline entry point."""
+
+# config libs
+from etl.config import Config
+# pipeline libs
+from etl.streaming import StreamingPipeline
+
+
+def run(local, overrides=None):
+    """The streaming.py script entry point to run the StreamingPipeline.
+
+    Args:
+        local: If True uses the AWS EMR and S3 configurations,
+            otherwise uses the local file system and the localhost
+            Spark session.
+        overrides: A dictionary of SECTION.OPTION keys and values
+            that override the etl.cfg options.
+    """
+    # sets the session host
+    config = Config(local=local, overrides=overrides)
+
+    # run the pipeline
+    pipeline = StreamingPipeline(config)
+    pipeline.start()
+    pipeline.stop()
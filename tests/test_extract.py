@@ -0,0 +1,95 @@
+"""Tests the projection of the columns read by the selected tables and
+the NextSong filter, both pushed down to the bronze Parquet scan of the
+extracted log data."""
+
+# sys libs
+import json
+# test libs
+import pytest
+
+pytest.importorskip('pyspark')
+
+# spark libs
+from pyspark.sql import SparkSession  # noqa: E402
+# pipeline libs
+from etl.config import Config  # noqa: E402
+from etl.explain import analyze  # noqa: E402
+from etl.pipeline import ETLPipeline  # noqa: E402
+
+OUTPUTS = ('BRONZE', 'SILVER', 'GOLD', 'MANIFEST', 'METRICS', 'CHECKPOINT', 'CACHE')
+"""The S3_LOCAL output directories, set to the test directory."""
+
+EVENTS = [
+    {'artist': 'Des\'ree', 'firstName': 'Kaylee', 'gender': 'F', 'itemInSession': 1, 'lastName': 'Summers',
+     'length': 246.30812, 'level': 'free', 'location': 'Phoenix-Mesa-Scottsdale, AZ', 'page': 'NextSong',
+     'sessionId': 139, 'song': 'You Gotta Be', 'ts': 1541106106796, 'userAgent': 'Mozilla/5.0', 'userId': '8'},
+    {'artist': None, 'firstName': 'Kaylee', 'gender': 'F', 'itemInSession': 2, 'lastName': 'Summers',
+     'length': None, 'level': 'free', 'location': 'Phoenix-Mesa-Scottsdale, AZ', 'page': 'Upgrade',
+     'sessionId': 139, 'song': None, 'ts': 1541106132796, 'userAgent': 'Mozilla/5.0', 'userId': '8'}
+]
+"""The log events of the landing file, one of them is not a NextSong."""
+
+
+@pytest.fixture(scope='module')
+def spark():
+    """Creates a local Spark session shared by the tests of the module."""
+    session = SparkSession.builder \
+        .master('local[1]') \
+        .appName('etl-tests') \
+        .config('spark.sql.shuffle.partitions', '1') \
+        .getOrCreate()
+    yield session
+    session.stop()
+
+
+def extract_logs(spark, root, tables):
+    """Extracts the log data of a landing file for the given tables.
+
+    Returns:
+        A tuple with the pipeline and the extracted DataFrame.
+    """
+    folder = root / 'landing' / 'log_data' / '2018' / '11'
+    folder.mkdir(parents=True)
+    (folder / '2018-11-01-events.json').write_text('\n'.join(json.dumps(event) for event in EVENTS))
+
+    overrides = {f'S3_LOCAL.{option}': str(root / option.lower()) for option in OUTPUTS}
+    overrides.update({'S3_LOCAL.LANDING': str(root / 'landing'),
+                      'PIPELINE.TABLES': ','.join(tables),
+                      'CACHE.ENABLED': 'False'})
+    pipeline = ETLPipeline(Config(local=True, overrides=overrides), spark=spark)
+    return pipeline, pipeline._extract_logs()
+
+
+def scan(data):
+    """Returns the ReadSchema column names and the PushedFilters of
+    the single Parquet scan in the physical plan of a DataFrame."""
+    scans = analyze(data)['scans']
+    assert len(scans) == 1
+    read_schema = scans[0]['read_schema'][len('struct<'):-1]
+    return {field.split(':')[0] for field in read_schema.split(',')}, scans[0]['pushed_filters']
+
+
+def test_songplays_read_schema(spark, tmp_path):
+    """The songplays read only their columns and the filtered page."""
+    pipeline, logs = extract_logs(spark, tmp_path, ['songplays'])
+    read_schema, _ = scan(logs)
+
+    assert read_schema == set(pipeline._projection('logs')) | {'page'}
+    assert not read_schema & {'firstName', 'lastName', 'gender'}
+
+
+def test_users_read_schema(spark, tmp_path):
+    """The users read the user names."""
+    _, logs = extract_logs(spark, tmp_path, ['users'])
+    read_schema, _ = scan(logs)
+
+    assert {'firstName', 'lastName', 'gender'} <= read_schema
+
+
+def test_next_song_pushed_filter(spark, tmp_path):
+    """The NextSong filter is pushed down to the Parquet scan."""
+    _, logs = extract_logs(spark, tmp_path, ['songplays'])
+    _, pushed_filters = scan(logs)
+
+    assert 'EqualTo(page,NextSong)' in pushed_filters
+    assert logs.count() == 1